@@ -0,0 +1,61 @@
+import numpy as np
+
+# Matching based all-different filtering (Regin's algorithm) on the boolean matrix of a category pair
+# Rows and columns are the value IDs of the two categories, m[i, j] is True while row i can still be column j
+
+# Look for an augmenting path from row i, flipping the matching along it if one is found (Kuhn's algorithm)
+def augment(i, adj, match, owner, seen):
+    for j in adj[i]:
+        if not seen[j]:
+            seen[j] = True
+            if owner[j] == -1 or augment(owner[j], adj, match, owner, seen):
+                match[i] = j
+                owner[j] = i
+                return True
+    return False
+
+# Maximum matching of rows to columns
+# match can be a previous matching (row -> column, -1 when unmatched) to start from, edges no longer in m are dropped from it
+# Returns match, and owner (column -> row, -1 when unmatched)
+def max_matching(m, match=None):
+    n_rows, n_cols = m.shape
+    rows = np.arange(n_rows)
+    if match is None or len(match) != n_rows:
+        match = np.full(n_rows, -1)
+    else:
+        match = match.copy()
+        matched = match >= 0
+        match[ matched & ~m[ rows, np.where(matched, match, 0) ] ] = -1
+
+    owner = np.full(n_cols, -1)
+    owner[ match[match >= 0] ] = rows[match >= 0]
+
+    adj = [ np.flatnonzero(m[i]) for i in range(n_rows) ]
+    for i in range(n_rows):
+        if match[i] == -1:
+            augment(i, adj, match, owner, np.zeros(n_cols, dtype=bool))
+
+    return match, owner
+
+# Rows reachable from each row, including itself, in a graph given as a boolean adjacency matrix
+def reachability(graph):
+    reach = graph | np.eye( len(graph), dtype=bool )
+    while True:
+        longer = reach | ( reach @ reach )
+        if np.array_equal(longer, reach):
+            return reach
+        reach = longer
+
+# Mask of the possibilities in a square matrix that belong to at least one perfect matching
+# Every other possibility can be removed, since each row has to end up with a different column
+# Returns the mask (all False if there is no perfect matching at all) and the matching found, to start from next time
+def all_different(m, match=None):
+    match, owner = max_matching(m, match)
+    if (match == -1).any():
+        return np.zeros(m.shape, dtype=bool), match
+
+    # With a perfect matching, row i -> row k when i can take the column k is matched to
+    # Possibility (i, j) is supported when it is matched, or it closes an alternating cycle: owner[j] reaches i again
+    reach = reachability( m[:, match] )
+    supported = m & reach[owner, :].T
+    return supported, match
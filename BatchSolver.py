@@ -0,0 +1,133 @@
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+import itertools
+import time
+import os
+from LogicPuzzle import LogicPuzzle
+
+# Solve a corpus of puzzles across processes
+# Each puzzle is a (categories, rules) pair, where each is either a file name or a list of lines
+# Results are dicts, so they can be sent back from the worker processes and written out as they are:
+#   index       -> position of the puzzle in the input
+#   solved      -> whether the puzzle was completed
+#   contradiction -> whether the rules left a set with no possibilities
+#   iterations  -> rounds (or sweeps) of deduction
+#   nodes       -> search nodes used, 0 without search
+#   grid        -> rows of the solved grid, titles first
+#   error       -> None, or "ExceptionName: message" if the puzzle couldn't be read or solved
+#   time        -> seconds spent on the puzzle
+#   profile     -> only with the profile option, the profiling report of the solve (see Profiler.py)
+
+# Build a LogicPuzzle from file names or lines
+def load_puzzle(categories, rules):
+    if isinstance(categories, str):
+        f = open(categories)
+        categories = f.readlines()
+        f.close()
+    if isinstance(rules, str):
+        f = open(rules)
+        rules = f.readlines()
+        f.close()
+    return LogicPuzzle.from_lines(categories, rules)
+
+# Result for a puzzle that hasn't been solved
+def new_result(index, error=None):
+    return { "index" : index, "solved" : False, "contradiction" : False, "iterations" : 0, "nodes" : 0,
+             "grid" : None, "error" : error, "time" : 0.0 }
+
+# Solve one puzzle, any exception is recorded in the result instead of being raised
+def solve_one(index, categories, rules, options):
+    result = new_result(index)
+    start = time.perf_counter()
+    try:
+        lp = load_puzzle(categories, rules)
+        # solve returns (solved, iterations, grid), and the profiling report after those with profile=True
+        results = lp.solve( show=False, return_results=True, **options )
+        result["solved"] = results[0]
+        result["contradiction"] = lp.contains_empty_sets()
+        result["iterations"] = results[1]
+        if options.get("profile", False):
+            result["profile"] = lp.profile_report
+        result["nodes"] = lp.nodes
+        result["grid"] = lp.get_grid().tolist()
+    except Exception as e:
+        result["error"] = "{}: {}".format( type(e).__name__, str(e) )
+    result["time"] = time.perf_counter() - start
+    return result
+
+# Solve a chunk of (index, categories, rules) in a worker
+def solve_chunk(chunk, options):
+    return [ solve_one(index, categories, rules, options) for index, categories, rules in chunk ]
+
+# Results for every puzzle of a chunk whose worker failed (e.g. the process died)
+def failed_chunk(chunk, error):
+    message = "{}: {}".format( type(error).__name__, str(error) )
+    return [ new_result(index, message) for index, categories, rules in chunk ]
+
+# Start solving a chunk in the pool, if the pool is broken the future holds the error instead
+def submit(executor, chunk, options):
+    try:
+        return executor.submit(solve_chunk, chunk, options)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+# Group the puzzles into lists of chunk_size (index, categories, rules), without reading ahead of what's needed
+def chunked(puzzles, chunk_size):
+    numbered = ( (index, categories, rules) for index, (categories, rules) in enumerate(puzzles) )
+    while True:
+        chunk = list( itertools.islice(numbered, chunk_size) )
+        if not chunk:
+            return
+        yield chunk
+
+# Solve every (categories, rules) in puzzles, yielding a result dict per puzzle as soon as it's available
+# ordered=True yields results in input order, otherwise they're yielded in the order they finish
+# Only a few chunks per worker are in flight at a time, so puzzles can be a generator over a corpus of any size
+# workers=0 solves everything in this process, which is easier to debug
+# Any other keyword arguments (search, node_limit, time_limit, worklist, ...) are passed on to LogicPuzzle.solve
+def solve_many(puzzles, workers=None, chunk_size=16, ordered=True, **options):
+    chunks = chunked(puzzles, chunk_size)
+    if workers == 0:
+        for chunk in chunks:
+            for result in solve_chunk(chunk, options):
+                yield result
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()                   # (future, chunk) in the order they were submitted
+        for chunk in itertools.islice(chunks, 4 * workers):
+            pending.append( ( submit(executor, chunk, options), chunk ) )
+
+        try:
+            yield from collect(executor, pending, chunks, ordered, options)
+        finally:
+            # Stopping early shouldn't wait on puzzles nobody will read
+            for future, chunk in pending:
+                future.cancel()
+
+# Yield the results of the pending chunks, submitting a new chunk for each one that's done
+def collect(executor, pending, chunks, ordered, options):
+    while pending:
+        if ordered:
+            done = [ pending.popleft() ]
+        else:
+            finished, _ = wait( [ future for future, chunk in pending ], return_when=FIRST_COMPLETED )
+            done = [ item for item in pending if item[0] in finished ]
+            for item in done:
+                pending.remove(item)
+
+        for future, chunk in done:
+            try:
+                results = future.result()
+            except Exception as e:
+                results = failed_chunk(chunk, e)
+            for result in results:
+                yield result
+
+            for chunk in itertools.islice(chunks, 1):
+                pending.append( ( submit(executor, chunk, options), chunk ) )
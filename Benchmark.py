@@ -0,0 +1,91 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from Generator import generate_puzzles
+from Corpus import write_corpus
+from BatchSolver import load_puzzle
+
+# Scaling benchmark for LogicPuzzle.solve on generated puzzles
+# Every run is written as one JSON line, so results from different commits can be compared:
+#   n_categories, n_values, numeric, seed, rules -> the generated puzzle
+#   worklist    -> whether the propagation worklist or the old sweeps were used
+#   parse_time  -> seconds to read the categories and rules
+#   solve_time  -> seconds to solve
+#   sweeps      -> rounds (or sweeps) of deduction
+#   tasks       -> rules and logic functions run by the worklist (None for sweeps)
+#   changes     -> changes made to the domain store
+#   peak_memory -> peak bytes allocated while reading and solving, measured in a separate run
+#   solved      -> whether the puzzle was solved
+
+# Time reading and solving one generated puzzle
+def run_one(record, worklist=True):
+    start = time.perf_counter()
+    lp = load_puzzle( record["categories"], record["rules"] )
+    parsed = time.perf_counter()
+    solved, sweeps, _ = lp.solve( show=False, return_results=True, worklist=worklist )
+    solved_at = time.perf_counter()
+
+    return { "parse_time" : parsed - start,
+             "solve_time" : solved_at - parsed,
+             "sweeps" : sweeps,
+             "tasks" : lp.propagation.tasks_run if worklist else None,
+             "changes" : len(lp.store.trail),
+             "solved" : solved }
+
+# Peak bytes allocated reading and solving one puzzle
+# tracemalloc slows everything down, so this isn't part of the timed run
+def peak_memory(record, worklist=True):
+    tracemalloc.start()
+    try:
+        lp = load_puzzle( record["categories"], record["rules"] )
+        lp.solve( show=False, worklist=worklist )
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Yield a result for every size, seed and solving mode
+# sizes is a list of (n_categories, n_values), the same seeds give the same puzzles on every run
+def run_benchmark(sizes, seeds=5, numeric=1, worklist=[True], memory=True):
+    for n_categories, n_values in sizes:
+        records = generate_puzzles( seeds, seed=0, n_categories=n_categories, n_values=n_values, numeric=min(numeric, n_categories) )
+        for seed, record in enumerate(records):
+            for mode in worklist:
+                result = { "n_categories" : n_categories, "n_values" : n_values, "numeric" : min(numeric, n_categories),
+                           "seed" : seed, "rules" : len( record["rules"] ), "worklist" : mode }
+                result.update( run_one(record, mode) )
+                result["peak_memory"] = peak_memory(record, mode) if memory else None
+                yield result
+
+# Sizes given as "3x4,4x5", categories x values
+def parse_sizes(text):
+    sizes = []
+    for size in text.split(","):
+        n_categories, n_values = size.lower().split("x")
+        sizes.append( ( int(n_categories), int(n_values) ) )
+    return sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser( description="Time LogicPuzzle.solve on generated puzzles of increasing size" )
+    parser.add_argument( "--sizes", default="3x4,3x6,4x6,4x8,5x8", help="comma separated categories x values, e.g. 3x4,4x5" )
+    parser.add_argument( "--seeds", type=int, default=5, help="puzzles per size" )
+    parser.add_argument( "--numeric", type=int, default=1, help="numerical categories per puzzle" )
+    parser.add_argument( "--sweep", action="store_true", help="also run the old sweeps, to compare against the worklist" )
+    parser.add_argument( "--no-memory", action="store_true", help="skip the peak memory runs" )
+    parser.add_argument( "--out", default="benchmark.jsonl", help="JSON lines file the results are written to (- for stdout)" )
+    args = parser.parse_args(argv)
+
+    results = run_benchmark( parse_sizes(args.sizes), args.seeds, args.numeric,
+                             worklist=[True, False] if args.sweep else [True], memory=not args.no_memory )
+    header = { "benchmark" : "solve", "time" : time.strftime("%Y-%m-%dT%H:%M:%S"), "python" : platform.python_version(), "machine" : platform.machine() }
+    if args.out == "-":
+        for result in results:
+            print( json.dumps( dict(result, **header) ) )
+    else:
+        count = write_corpus( args.out, ( dict(result, **header) for result in results ) )
+        print( "Wrote {} results to {}".format(count, args.out) )
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
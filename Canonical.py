@@ -0,0 +1,83 @@
+import hashlib
+import json
+
+# Canonical form of a puzzle, the same for every puzzle that only differs in the order of its category lines, its rule
+# lines or the values inside a category (and in whitespace, comments and how numbers are written), so they share
+# one cache entry or are solved once in a batch
+#   categories  -> category lines sorted by title, each with its values sorted (numerically for numerical categories)
+#   rules       -> normalized rule lines, sorted, without duplicates
+# Propagation reaches the same fixed point whatever order the rules are run in, so the solution doesn't depend on any of
+# these orders. The layout of the grid does: get_grid keys its rows on the first category and orders its columns the way
+# the categories were given, so grids are translated between the canonical layout and the caller's (see to_caller)
+
+# (title, values, numerical) of a category line, values as LogicPuzzle would read them
+def parse_category(line):
+    title, _, values = line.partition(":")
+    values = [ val.strip() for val in values.split(",") ]
+    try:
+        return title.strip(), [ float(val) for val in values ], True
+    except ValueError:
+        return title.strip(), values, False
+
+def normalize_rule(line):
+    if "#" in line:
+        line = line[ : line.index("#") ]
+    return " ".join( line.split() )
+
+class CanonicalPuzzle:
+    def __init__(self, categories, rules):
+        if isinstance(categories, str):
+            categories = categories.splitlines()
+        if isinstance(rules, str):
+            rules = rules.splitlines()
+
+        parsed = [ parse_category(line) for line in categories if line.strip() != "" ]
+        self.titles = [ title for title, values, numerical in parsed ]      # the caller's categories, in the caller's order
+        self.numerical = set( [ title for title, values, numerical in parsed if numerical ] )
+
+        self.category_lines = []
+        for title, values, numerical in sorted(parsed):
+            self.category_lines.append( "{} : {}".format( title, ", ".join( [ str(val) for val in sorted( set(values) ) ] ) ) )
+        self.rule_lines = sorted( set( [ normalize_rule(line) for line in rules if normalize_rule(line) != "" ] ) )
+        self.canonical_titles = sorted(self.titles)
+
+    # Hash of the canonical form and the solve options, as a hex string
+    def key(self, options=None):
+        text = json.dumps( [ self.category_lines, self.rule_lines, options or {} ], sort_keys=True )
+        return hashlib.sha256( text.encode("utf-8") ).hexdigest()
+
+    # Grid with the layout of get_grid for categories given in order titles, from a grid of the same puzzle given in order from_titles
+    # Rows are entities, so when the key category changes they're sorted again on the new key. That's only possible when
+    # every row is complete, otherwise there's no way to tell which rows are the same entity, and None is returned
+    def translate(self, grid, from_titles, titles):
+        if grid is None or len(titles) == 0:
+            return None
+        layout = [ titles[0] ] + [ title for title in titles if title != titles[0] ]
+        from_layout = [ from_titles[0] ] + [ title for title in from_titles if title != from_titles[0] ]
+        if sorted(layout) != sorted( grid[0] ) or grid[0] != from_layout:
+            return None
+
+        columns = [ grid[0].index(title) for title in layout ]
+        rows = [ [ row[i] for i in columns ] for row in grid[1:] ]
+        if layout[0] != from_layout[0]:
+            if any( [ cell == "" for row in rows for cell in row ] ):
+                return None
+            if layout[0] in self.numerical:
+                rows.sort( key=lambda row: float( row[0] ) )
+            else:
+                rows.sort( key=lambda row: row[0] )
+        return [ layout ] + rows
+
+    # A grid solved from the caller's lines in the canonical layout, or None if it can't be translated
+    def to_canonical(self, grid):
+        return self.translate(grid, self.titles, self.canonical_titles)
+
+    # A grid solved from the canonical lines in the caller's layout, or None if it can't be translated
+    def to_caller(self, grid):
+        return self.translate(grid, self.canonical_titles, self.titles)
+
+# For each (categories, rules) in puzzles, the index of the first puzzle with the same canonical form
+# A batch only needs to solve the puzzles that are their own first
+def first_duplicates(puzzles):
+    firsts = {}
+    return [ firsts.setdefault( CanonicalPuzzle(categories, rules).key(), index ) for index, (categories, rules) in enumerate(puzzles) ]
@@ -0,0 +1,86 @@
+import json
+import gzip
+import os
+from BatchSolver import load_puzzle
+
+# Puzzle corpora as JSON lines, one puzzle per line, so a corpus is a single file that's read and written as a stream
+# Each record is a dict:
+#   id          -> optional name of the puzzle
+#   categories  -> list of category lines, as in categories.txt
+#   rules       -> list of rule lines, as in rules.txt
+#   solution    -> optional expected grid, as rows of strings with the titles first (the same as LogicPuzzle.get_grid)
+# Files ending in .gz are compressed
+
+def open_corpus(f_name, mode):
+    if f_name.endswith(".gz"):
+        return gzip.open(f_name, mode + "t", encoding="utf-8")
+    return open(f_name, mode, encoding="utf-8")
+
+# Yield the records of a corpus one at a time, blank lines are skipped
+def read_corpus(f_name):
+    f = open_corpus(f_name, "r")
+    try:
+        line_number = 0
+        for line in f:
+            line_number += 1
+            if line.strip() == "":
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError( "{} line {}: {}".format(f_name, line_number, str(e)) )
+            if not "categories" in record or not "rules" in record:
+                raise ValueError( "{} line {}: record needs categories and rules".format(f_name, line_number) )
+            yield record
+    finally:
+        f.close()
+
+# Write every record to a corpus as it's generated, append=True adds to the end of an existing corpus
+# Returns the number of records written
+def write_corpus(f_name, records, append=False):
+    count = 0
+    f = open_corpus(f_name, "a" if append else "w")
+    try:
+        for record in records:
+            f.write( json.dumps(record) )
+            f.write( "\n" )
+            count += 1
+    finally:
+        f.close()
+    return count
+
+# (categories, rules) of each record, as taken by BatchSolver.solve_many
+def corpus_puzzles(records):
+    for record in records:
+        yield record["categories"], record["rules"]
+
+# LogicPuzzle for a record, ready to solve
+def puzzle_from_record(record):
+    return load_puzzle( record["categories"], record["rules"] )
+
+# Record for a puzzle made of a categories file and a rules file
+def record_from_files(category_f_name, rule_f_name, puzzle_id=None, solution=None):
+    record = {}
+    if not puzzle_id is None:
+        record["id"] = puzzle_id
+    for key, f_name in [ ("categories", category_f_name), ("rules", rule_f_name) ]:
+        f = open(f_name, encoding="utf-8-sig")
+        record[key] = [ line.rstrip("\n") for line in f if line.strip() != "" ]
+        f.close()
+    if not solution is None:
+        record["solution"] = solution
+    return record
+
+# Records for every directory of games_dir with a categories.txt and rules.txt (e.g. Games/gameN), in name order
+def records_from_games(games_dir):
+    for name in sorted( os.listdir(games_dir) ):
+        category_f_name = os.path.join(games_dir, name, "categories.txt")
+        rule_f_name = os.path.join(games_dir, name, "rules.txt")
+        if os.path.isfile(category_f_name) and os.path.isfile(rule_f_name):
+            yield record_from_files(category_f_name, rule_f_name, puzzle_id=name)
+
+# Whether a grid (as in BatchSolver results) is the record's expected solution, None if the record doesn't have one
+def matches_solution(record, grid):
+    if not "solution" in record:
+        return None
+    return grid == record["solution"]
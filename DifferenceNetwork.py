@@ -0,0 +1,55 @@
+import numpy as np
+
+# Difference constraints between the values a numerical category gives different elements (rule 5)
+# Each element is a node, and x_A - x_B <= w is an edge from B to A with weight w:
+#   A > B       -> x_B - x_A <= -gap, gap being the smallest difference between two values of the category
+#   A = B + val -> x_A - x_B <= val and x_B - x_A <= -val
+# All shortest paths are found once when the network is built (Floyd-Warshall), so the bounds every element gets from
+# the bounds of every other element, through any chain of rules, are a single step. A negative cycle means the rules
+# can't all hold
+class DifferenceNetwork:
+    def __init__(self, values, constraints):
+        self.values = values                # sorted array of the values of the category
+        self.nodes = []                     # (cat, el) of each node
+        self.ids = {}                       # dict from (cat, el) to node index
+        for cat_A, el_A, cat_B, el_B, val in constraints:
+            for unit in [ (cat_A, el_A), (cat_B, el_B) ]:
+                if not unit in self.ids:
+                    self.ids[unit] = len(self.nodes)
+                    self.nodes.append(unit)
+
+        gaps = np.diff(values)
+        gap = gaps.min() if len(gaps) > 0 else 0.0
+        self.tolerance = 1e-9 * max( 1.0, np.abs(values).max() if len(values) > 0 else 1.0 )
+
+        # dist[i, j] is the most x_j - x_i can be
+        n = len(self.nodes)
+        dist = np.full( (n, n), np.inf )
+        np.fill_diagonal(dist, 0.0)
+        for cat_A, el_A, cat_B, el_B, val in constraints:
+            a = self.ids[ (cat_A, el_A) ]
+            b = self.ids[ (cat_B, el_B) ]
+            if val is None:
+                dist[a, b] = min( dist[a, b], -gap )
+            else:
+                dist[b, a] = min( dist[b, a], val )
+                dist[a, b] = min( dist[a, b], -val )
+
+        for k in range(n):
+            dist = np.minimum( dist, dist[:, k:k+1] + dist[k:k+1, :] )
+        self.dist = dist
+        self.feasible = not ( np.diag(dist) < -self.tolerance ).any()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Tightest bounds on each node given lower and upper bounds on every node, as arrays in node order
+    # x_j <= x_i + dist[i, j] <= upper_i + dist[i, j], and x_j >= x_i - dist[j, i] >= lower_i - dist[j, i]
+    def bounds(self, lower, upper):
+        new_upper = ( upper[:, None] + self.dist ).min(axis=0)
+        new_lower = ( lower[None, :] - self.dist ).max(axis=1)
+        return new_lower, new_upper
+
+    # Mask over the values of the category, True for the values between lower and upper
+    def between(self, lower, upper):
+        return ( self.values >= lower - self.tolerance ) & ( self.values <= upper + self.tolerance )
@@ -0,0 +1,276 @@
+import numpy as np
+from collections.abc import MutableSet, Mapping
+from TraceRecorder import INTERSECTION, A_IS_B, A_IS_NOT_B
+
+# Keeps every (cat_A, el_A, cat_B) set of remaining possibilities as one row of a boolean matrix per pair of categories
+# Values are interned to integer IDs per category, so matrix(cat_A, cat_B)[i, j] is True while the i-th value
+# of cat_A can still be linked to the j-th value of cat_B
+# Each pair is only stored once, with cat_A before cat_B in the category order. matrix(cat_B, cat_A) is the transpose
+# of the same data, so (cat_A, el_A, cat_B) and (cat_B, el_B, cat_A) can never disagree
+class DomainStore:
+    def __init__(self, categories=[], category_values={}):
+        self.categories = list(categories)  # list of category titles, in the same order as the puzzle
+        self.values = {}                    # dict from category name to list of values, the position in the list is the value ID
+        self.ids = {}                       # dict from category name to dict of value -> value ID
+        self.matrices = {}                  # dict from (cat_A, cat_B) to boolean matrix of shape ( len(cat_A), len(cat_B) ), cat_A before cat_B
+        self.listeners = []                 # functions called as f(cat_A, cat_B, rows, cols) with the IDs of the rows and columns of a stored matrix that changed
+        self.trail = []                     # every change as ( (cat_A, cat_B), rows, cols ) of the cells that were flipped, oldest first
+        self.recorder = None                # TraceRecorder given every change, when a trace is being recorded
+        self.numerics = {}                  # dict from numerical category to its values as a sorted array, built on first use
+        self.shifts = {}                    # dict from (category, val) to the arrays returned by shift
+
+        for cat in self.categories:
+            self.values[cat] = sorted( category_values[cat] )
+            self.ids[cat] = { val : i for i, val in enumerate( self.values[cat] ) }
+
+        for i in range(len(self.categories)):
+            cat_A = self.categories[i]
+            for cat_B in self.categories[i+1:]:
+                self.matrices[ (cat_A, cat_B) ] = np.ones( ( len(self.values[cat_A]), len(self.values[cat_B]) ), dtype=bool )
+
+    ##### Lookup Functions #############################################################################################################
+
+    # Ordered category pairs, in the same order the original dict of sets was created
+    def pairs(self):
+        for i in range(len(self.categories)):
+            cat_A = self.categories[i]
+            for cat_B in self.categories[i+1:]:
+                yield (cat_A, cat_B)
+                yield (cat_B, cat_A)
+
+    # Every (cat_A, el_A, cat_B) key, in the same order the original dict of sets was created
+    def keys(self):
+        for cat_A, cat_B in self.pairs():
+            for el_A in self.values[cat_A]:
+                yield (cat_A, el_A, cat_B)
+
+    def __len__(self):
+        return sum( [ len(self.values[cat_A]) for cat_A, cat_B in self.pairs() ] )
+
+    def __contains__(self, key):
+        cat_A, el_A, cat_B = key
+        return self.has_pair(cat_A, cat_B) and el_A in self.ids[cat_A]
+
+    def has_pair(self, cat_A, cat_B):
+        return (cat_A, cat_B) in self.matrices or (cat_B, cat_A) in self.matrices
+
+    # The matrix for (cat_A, cat_B), which is a transposed view when the pair is stored the other way around
+    # Writing to it writes to the store
+    def matrix(self, cat_A, cat_B):
+        if (cat_A, cat_B) in self.matrices:
+            return self.matrices[ (cat_A, cat_B) ]
+        return self.matrices[ (cat_B, cat_A) ].T
+
+    # The boolean row for (cat_A, el_A, cat_B)
+    def row(self, cat_A, el_A, cat_B):
+        return self.matrix(cat_A, cat_B)[ self.ids[cat_A][el_A] ]
+
+    # Boolean mask over the values of a category, True for every value in els
+    def mask(self, cat, els):
+        mask = np.zeros( len(self.values[cat]), dtype=bool )
+        ids = self.ids[cat]
+        for el in els:
+            if el in ids:
+                mask[ ids[el] ] = True
+        return mask
+
+    # Set of values of cat for which mask is True
+    def to_set(self, cat, mask):
+        vals = self.values[cat]
+        return set( [ vals[j] for j in np.flatnonzero(mask) ] )
+
+    def get(self, cat_A, el_A, cat_B):
+        return self.to_set( cat_B, self.row(cat_A, el_A, cat_B) )
+
+    def contains(self, cat_A, el_A, cat_B, el_B):
+        j = self.ids[cat_B].get(el_B)
+        return j is not None and bool( self.row(cat_A, el_A, cat_B)[j] )
+
+    # Values of a numerical category as an array, aligned with the value IDs
+    # Values are sorted, so a higher ID is always a higher value. The array is shared, so it's read only
+    def numeric(self, cat):
+        if not cat in self.numerics:
+            values = np.array( self.values[cat], dtype=float )
+            values.flags.writeable = False
+            self.numerics[cat] = values
+        return self.numerics[cat]
+
+    # For each value ID of a numerical category, the ID of the value val higher, as (valid, target) arrays
+    # valid is False where there is no such value. Found by binary search once per (cat, val), then kept
+    def shift(self, cat, val):
+        key = (cat, val)
+        if not key in self.shifts:
+            values = self.numeric(cat)
+            target = np.minimum( np.searchsorted( values, values + val ), len(values) - 1 )
+            valid = values[target] == values + val
+            self.shifts[key] = (valid, target)
+        return self.shifts[key]
+
+    ##### Update Functions #############################################################################################################
+
+    # Every change to a matrix goes through here, and is recorded on the trail
+    # rows selects which rows of the matrix are replaced by new (all of them by default)
+    # kind is the kind of change for the trace recorder (see TraceRecorder)
+    # Returns whether anything changed
+    def update(self, cat_A, cat_B, new, rows=slice(None), kind=INTERSECTION):
+        m = self.matrix(cat_A, cat_B)
+        flips = m[rows] != new
+        if not flips.any():
+            return False
+
+        if isinstance(rows, slice):
+            flip_rows, flip_cols = np.nonzero(flips)
+        else:
+            flip_cols = np.flatnonzero(flips)
+            flip_rows = np.full( len(flip_cols), rows )
+
+        m[rows] = new
+
+        # Record the change in the orientation it is stored in
+        if not (cat_A, cat_B) in self.matrices:
+            cat_A, cat_B = cat_B, cat_A
+            flip_rows, flip_cols = flip_cols, flip_rows
+        self.trail.append( ( (cat_A, cat_B), flip_rows, flip_cols ) )
+        if not self.recorder is None:
+            self.recorder.record( (cat_A, cat_B), kind, flip_rows, flip_cols )
+
+        if self.listeners:
+            changed_rows = np.unique(flip_rows)
+            changed_cols = np.unique(flip_cols)
+            for listener in self.listeners:
+                listener(cat_A, cat_B, changed_rows, changed_cols)
+        return True
+
+    # Intersect the whole matrix with mask
+    def restrict(self, cat_A, cat_B, mask, kind=INTERSECTION):
+        m = self.matrix(cat_A, cat_B)
+        return self.update( cat_A, cat_B, m & mask, kind=kind )
+
+    # Intersect the row of value ID i with mask
+    def restrict_row(self, cat_A, i, cat_B, mask, kind=INTERSECTION):
+        m = self.matrix(cat_A, cat_B)
+        return self.update( cat_A, cat_B, m[i] & mask, rows=i, kind=kind )
+
+    # (cat_A, el_A, cat_B) = (cat_A, el_A, cat_B) intersect els
+    def intersect(self, cat_A, el_A, cat_B, els):
+        return self.restrict_row( cat_A, self.ids[cat_A][el_A], cat_B, self.mask(cat_B, els) )
+
+    # (cat_A, el_A, cat_B) = els, which may add values back, this is only used by the dict of sets facade
+    def assign(self, cat_A, el_A, cat_B, els):
+        return self.update( cat_A, cat_B, self.mask(cat_B, els), rows=self.ids[cat_A][el_A] )
+
+    # el_A can only be el_B, and no other value of cat_A can be el_B
+    def link(self, cat_A, el_A, cat_B, el_B):
+        m = self.matrix(cat_A, cat_B)
+        i = self.ids[cat_A][el_A]
+        j = self.ids[cat_B].get(el_B)
+        mask = np.ones( m.shape, dtype=bool )
+        mask[i, :] = False
+        if not j is None:
+            mask[:, j] = False
+            mask[i, j] = True
+        return self.restrict( cat_A, cat_B, mask, kind=A_IS_B )
+
+    # el_A can not be el_B
+    def unlink(self, cat_A, el_A, cat_B, el_B):
+        j = self.ids[cat_B].get(el_B)
+        if j is None:
+            return False
+        mask = np.ones( len(self.values[cat_B]), dtype=bool )
+        mask[j] = False
+        return self.restrict_row( cat_A, self.ids[cat_A][el_A], cat_B, mask, kind=A_IS_NOT_B )
+
+    ##### State Functions ##############################################################################################################
+
+    # Every row and every column has exactly one possibility left
+    def is_complete(self):
+        if len(self.matrices) == 0:
+            return False
+        return all( [ ( m.sum(axis=1) == 1 ).all() and ( m.sum(axis=0) == 1 ).all() for m in self.matrices.values() ] )
+
+    def contains_empty(self):
+        return any( [ not ( m.any(axis=1).all() and m.any(axis=0).all() ) for m in self.matrices.values() if m.size > 0 ] )
+
+    # Number of possibilities left, each (el_A, el_B) of a pair of categories counted once
+    def remaining(self):
+        return int( sum( [ m.sum() for m in self.matrices.values() ] ) )
+
+    ##### Trail Functions ##############################################################################################################
+
+    # Mark the current state, to check for changes or roll back to later
+    def checkpoint(self):
+        return len(self.trail)
+
+    def changed_since(self, mark):
+        return len(self.trail) > mark
+
+    # Undo every change made after mark, newest first
+    # The cost only depends on how much changed, not on the size of the puzzle
+    def rollback(self, mark):
+        if not self.recorder is None and len(self.trail) > mark:
+            self.recorder.record_rollback( sum( [ len(flip_rows) for pair, flip_rows, flip_cols in self.trail[mark:] ] ) )
+        while len(self.trail) > mark:
+            pair, flip_rows, flip_cols = self.trail.pop()
+            self.matrices[pair][flip_rows, flip_cols] ^= True
+
+# A live, mutable set view over one (cat_A, el_A, cat_B) row of a DomainStore
+class DomainSet(MutableSet):
+    def __init__(self, store, cat_A, el_A, cat_B):
+        self.store = store
+        self.key = (cat_A, el_A, cat_B)
+
+    @classmethod
+    def _from_iterable(cls, it):
+        # Results of set operations (a - b, a & b, ...) are plain sets
+        return set(it)
+
+    def __contains__(self, el_B):
+        return self.store.contains(*self.key, el_B)
+
+    def __iter__(self):
+        return iter( self.store.get(*self.key) )
+
+    def __len__(self):
+        return int( self.store.row(*self.key).sum() )
+
+    def __repr__(self):
+        return repr( self.store.get(*self.key) )
+
+    def add(self, el_B):
+        self.store.assign( *self.key, self.store.get(*self.key) | set([el_B]) )
+
+    def discard(self, el_B):
+        self.store.unlink( *self.key, el_B )
+
+    def __iand__(self, other):
+        self.store.intersect( *self.key, other )
+        return self
+
+    def __isub__(self, other):
+        cat_A, el_A, cat_B = self.key
+        self.store.restrict_row( cat_A, self.store.ids[cat_A][el_A], cat_B, ~self.store.mask(cat_B, other) )
+        return self
+
+# Compatibility facade giving the old dict from (cat_A, el_A, cat_B) to set of remaining values, backed by a DomainStore
+class DomainSetMap(Mapping):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, key):
+        if not key in self.store:
+            raise KeyError(key)
+        return DomainSet( self.store, *key )
+
+    def __setitem__(self, key, els):
+        if not key in self.store:
+            raise KeyError(key)
+        self.store.assign( *key, els )
+
+    def __iter__(self):
+        return self.store.keys()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, key):
+        return key in self.store
@@ -66,6 +66,10 @@ class Ui_MainWindow(object):
         self.reset_button = QtWidgets.QPushButton(self.centralwidget)
         self.reset_button.setGeometry(QtCore.QRect(250, 520, 100, 30))
         self.reset_button.setObjectName("reset_button")
+        self.cancel_button = QtWidgets.QPushButton(self.centralwidget)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.setGeometry(QtCore.QRect(370, 520, 100, 30))
+        self.cancel_button.setObjectName("cancel_button")
         self.result_text = QtWidgets.QLabel(self.centralwidget)
         self.result_text.setGeometry(QtCore.QRect(10, 40, 400, 300))
         font = QtGui.QFont()
@@ -102,5 +106,6 @@ class Ui_MainWindow(object):
         self.solve_button.setText(_translate("MainWindow", "Solve"))
         self.clear_button.setText(_translate("MainWindow", "Clear"))
         self.reset_button.setText(_translate("MainWindow", "Reset"))
+        self.cancel_button.setText(_translate("MainWindow", "Cancel"))
         self.menuFile.setTitle(_translate("MainWindow", "File"))
         self.actionTutorial.setText(_translate("MainWindow", "Tutorial"))
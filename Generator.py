@@ -0,0 +1,269 @@
+import random
+from LogicPuzzle import LogicPuzzle
+from PropagationQueue import PropagationQueue
+
+# Seeded generator of solvable puzzles, as corpus records (see Corpus.py)
+# A hidden solution is drawn first, then random clues that are true for it are added until the clues solve the puzzle
+# Every category has n_values values, and entity i is the i-th value of each category in the hidden solution
+
+# Default mix of rule types (the numbers from Grammar.txt), as relative weights
+# Rule 5 needs a numerical category, it's skipped when there isn't one
+RULE_MIX = { 1 : 1, 2 : 3, 3 : 2, 4 : 1, 5 : 3, 6 : 1 }
+
+class PuzzleGenerator:
+    def __init__(self, seed=0, n_categories=3, n_values=4, numeric=1, rule_mix=None, max_clues=None):
+        if n_categories < 2 or n_values < 2:
+            raise ValueError("Puzzles need at least 2 categories of at least 2 values")
+        if numeric > n_categories:
+            raise ValueError("More numerical categories than categories")
+
+        self.rng = random.Random(seed)
+        self.n_values = n_values
+        self.rule_mix = dict( RULE_MIX if rule_mix is None else rule_mix )
+        self.max_clues = 10 * n_categories * n_values if max_clues is None else max_clues
+        self.categories = []                # list of category titles, the last numeric of them are numerical
+        self.values = {}                    # dict from category title to list of values as written, in entity order
+        self.numerical = []                 # titles of the numerical categories
+
+        for c in range(n_categories):
+            title = "C{}".format(c)
+            if c >= n_categories - numeric:
+                # Distinct integers, so differences between them make + clues
+                step = self.rng.randint(1, 5)
+                vals = [ str( step * (i+1) ) for i in range(n_values) ]
+                self.numerical.append(title)
+            else:
+                vals = [ "c{}v{}".format(c, i) for i in range(n_values) ]
+            self.rng.shuffle(vals)
+            self.categories.append(title)
+            self.values[title] = vals
+
+        if not self.numerical:
+            self.rule_mix.pop(5, None)
+
+    # Draw a new hidden solution for the same categories
+    def new_solution(self):
+        for title in self.categories:
+            self.rng.shuffle( self.values[title] )
+
+    # Lines of the categories file
+    def category_lines(self):
+        return [ "{} : {}".format( title, ", ".join( sorted( self.values[title] ) ) ) for title in self.categories ]
+
+    # The grid LogicPuzzle.get_grid gives for the hidden solution, as rows of strings with the titles first
+    def solution(self, puzzle):
+        return puzzle.get_grid().tolist() if puzzle.is_complete() else None
+
+    ##### Clues ########################################################################################################################
+
+    # Clues are (rule number, parameters, text), the parameters being the same as the parser gives for the text
+
+    # (category, value) of an entity, as the puzzle stores it
+    def unit(self, cat, entity):
+        if cat in self.numerical:
+            return ( cat, float( self.values[cat][entity] ) )
+        return ( cat, self.values[cat][entity] )
+
+    # How an element is written in a rule, numerical values need their category
+    def element(self, cat, entity):
+        if cat in self.numerical:
+            return "{}:{}".format( cat, self.values[cat][entity] )
+        return self.values[cat][entity]
+
+    def number(self, cat, entity):
+        return int( self.values[cat][entity] )
+
+    # Random category, other than the ones in exclude
+    def random_category(self, exclude=[]):
+        return self.rng.choice( [ cat for cat in self.categories if not cat in exclude ] )
+
+    def clue(self, rule_type):
+        rng = self.rng
+        # Three different entities, the third is None when there are only two
+        e1, e2, e3 = ( rng.sample( range(self.n_values), 3 ) if self.n_values > 2 else rng.sample( range(self.n_values), 2 ) + [None] )
+
+        if rule_type == 1 or rule_type == 2:
+            cat_A = self.random_category()
+            cat_B = self.random_category([cat_A])
+            e_B = e1 if rule_type == 1 else e2
+            text = "{} {} {}".format( self.element(cat_A, e1), "=" if rule_type == 1 else "!=", self.element(cat_B, e_B) )
+            return rule_type, list( self.unit(cat_A, e1) + self.unit(cat_B, e_B) ), text
+        if rule_type == 3:
+            cat_A = self.random_category()
+            M_star = [ (self.random_category([cat_A]), e) for e in (e1, e2) ]
+            rng.shuffle(M_star)
+            text = "{} = [{}]".format( self.element(cat_A, e1), ",".join( [ self.element(*el) for el in M_star ] ) )
+            return rule_type, list( self.unit(cat_A, e1) ) + [ [ self.unit(*el) for el in M_star ] ], text
+        if rule_type == 4:
+            N_cats = rng.sample( self.categories, min( 2, len(self.categories) - 1 ) )
+            N_star = [ (rng.choice(N_cats), e) for e in (e1, e2) ]
+            M_star = [ (self.random_category(N_cats), e) for e in (e1, e2) ]
+            rng.shuffle(M_star)
+            text = "[{}] = [{}]".format( ",".join( [ self.element(*el) for el in N_star ] ), ",".join( [ self.element(*el) for el in M_star ] ) )
+            return rule_type, [ [ self.unit(*el) for el in N_star ], [ self.unit(*el) for el in M_star ] ], text
+        if rule_type == 5:
+            cat_C = rng.choice(self.numerical)
+            big, small = (e1, e2) if self.number(cat_C, e1) > self.number(cat_C, e2) else (e2, e1)
+            cat_A = self.random_category([cat_C])
+            cat_B = self.random_category([cat_C])
+            params = list( self.unit(cat_A, big) + self.unit(cat_B, small) ) + [cat_C]
+            if rng.random() < 0.5:
+                text = "{},{} > {},{}".format( self.element(cat_A, big), cat_C, self.element(cat_B, small), cat_C )
+                return rule_type, params, text
+            diff = self.number(cat_C, big) - self.number(cat_C, small)
+            text = "{},{} = {},{} + {}".format( self.element(cat_A, big), cat_C, self.element(cat_B, small), cat_C, diff )
+            return rule_type, params + [ float(diff) ], text
+        if rule_type == 6:
+            N_star = [ (self.random_category(), e) for e in (e1, e2, e3) if not e is None ]
+            text = "[{}]".format( ",".join( [ self.element(*el) for el in N_star ] ) )
+            return rule_type, [ [ self.unit(*el) for el in N_star ] ], text
+        raise ValueError( "Unknown rule type {}".format(rule_type) )
+
+    def random_clue(self):
+        types = list(self.rule_mix)
+        return self.clue( self.rng.choices( types, weights=[ self.rule_mix[t] for t in types ] )[0] )
+
+    # A = clue for a value the clues haven't settled yet, so the puzzle always gets solved
+    def settling_clue(self, puzzle):
+        cat_A, el_A, cat_B = puzzle.smallest_domain()
+        ids = { val : i for i, val in enumerate( self.values[cat_A] ) }
+        entity = ids[ el_A if not cat_A in self.numerical else str( int(el_A) ) ]
+        text = "{} = {}".format( self.element(cat_A, entity), self.element(cat_B, entity) )
+        return 1, list( self.unit(cat_A, entity) + self.unit(cat_B, entity) ), text
+
+    # Clues are all true for the hidden solution, so they can't contradict each other, and each settling clue settles at
+    # least one more value, so at most limit clues are needed. Either going wrong would add clues forever, so it's an error
+    def check_clues(self, puzzle, attempts, limit):
+        if puzzle.contains_empty_sets() or ( not puzzle.propagation is None and puzzle.propagation.failed ):
+            raise RuntimeError("Clues true for the hidden solution contradict each other")
+        if attempts > limit:
+            raise RuntimeError( "Puzzle still unsolved after {} clues".format(attempts) )
+
+    ##### Generation ###################################################################################################################
+
+    # Generate one puzzle, returned as a corpus record with the rules in the order they were added
+    def generate(self, puzzle_id=None):
+        lp = LogicPuzzle()
+        lp.set_categories( self.category_lines() )
+        lp.create_sets()
+
+        rules = []
+        lp.propagate()
+        limit = self.max_clues + lp.store.remaining()
+        while not lp.is_complete():
+            self.check_clues(lp, len(rules), limit)
+            rule_type, params, text = self.random_clue() if len(rules) < self.max_clues else self.settling_clue(lp)
+            rules.append(text)
+            lp.set_rule_lines( [text] )
+            lp.propagate()
+
+        record = { "categories" : self.category_lines(), "rules" : rules, "solution" : self.solution(lp) }
+        if not puzzle_id is None:
+            record["id"] = puzzle_id
+        return record
+
+# Generate count puzzles, the puzzle with index i only depends on seed and i
+def generate_puzzles(count, seed=0, **options):
+    for i in range(count):
+        generator = PuzzleGenerator( seed=seed * 1000003 + i, **options )
+        yield generator.generate( puzzle_id="{}-{}".format(seed, i) )
+
+# Generates puzzles that deduction alone solves, so they have exactly one solution
+# One LogicPuzzle and propagation queue is kept for every puzzle of the generator, instead of parsing and solving from
+# scratch after every clue. Candidate clues are compiled straight to propagators and only propagated from what they change,
+# clues that change nothing are dropped straight away, and once the puzzle is solved, minimize drops every clue the others
+# make redundant by rolling back to checkpoints
+class UniquePuzzleGenerator(PuzzleGenerator):
+    def __init__(self, seed=0, n_categories=3, n_values=4, numeric=1, rule_mix=None, max_clues=None, minimize=True):
+        super().__init__(seed, n_categories, n_values, numeric, rule_mix, max_clues)
+        self.minimize_clues = minimize
+        self.puzzle = LogicPuzzle()
+        self.puzzle.set_categories( self.category_lines() )
+        self.puzzle.create_sets()
+        self.texts = []                     # text of each rule in puzzle.rules
+        self.generated = 0                  # number of puzzles generated so far
+
+    # Back to no rules and every possibility open, without building a new puzzle
+    # Everything the puzzle worked out from the old rules goes too, the new rules reuse their indices
+    def reset(self):
+        lp = self.puzzle
+        lp.rollback(0)
+        lp.rules = []
+        lp.rule_marks = {}
+        lp.matchings = {}
+        lp.networks = {}
+        self.texts = []
+        lp.propagation = PropagationQueue(lp)
+
+    # Compile a clue and start propagating it, returns its index in puzzle.rules
+    def add_clue(self, rule_type, params, text):
+        lp = self.puzzle
+        lp.rules.append( lp.rule_types[rule_type](lp, params) )
+        self.texts.append( text )
+        lp.propagation.watch_rule( len(lp.rules) - 1 )
+        lp.propagation.run()
+        return len(lp.rules) - 1
+
+    def generate(self, puzzle_id=None):
+        if self.generated > 0:
+            self.new_solution()
+        self.generated += 1
+        self.reset()
+        lp = self.puzzle
+
+        kept = []
+        attempts = 0
+        limit = self.max_clues + lp.store.remaining()
+        while not lp.is_complete():
+            self.check_clues(lp, attempts, limit)
+            clue = self.random_clue() if attempts < self.max_clues else self.settling_clue(lp)
+            attempts += 1
+            mark = lp.checkpoint()
+            ind = self.add_clue(*clue)
+            if lp.store.changed_since(mark):
+                kept.append(ind)
+            else:
+                lp.propagation.unwatch_rule(ind)
+
+        if self.minimize_clues:
+            kept = self.minimize(kept)
+
+        record = { "categories" : self.category_lines(), "rules" : [ self.texts[ind] for ind in kept ], "solution" : self.solution(lp) }
+        if not puzzle_id is None:
+            record["id"] = puzzle_id
+        return record
+
+    # Drop every clue the clues kept so far and the clues after it already solve the puzzle without
+    # The state for the clues kept so far is a checkpoint, so each check only propagates the clues after the one being tried
+    # Leaves the puzzle solved by the clues returned
+    def minimize(self, kept):
+        lp = self.puzzle
+        queue = lp.propagation
+        lp.rollback(0)
+        for ind in kept:
+            queue.unwatch_rule(ind)
+
+        needed = []
+        for i in range(len(kept)):
+            mark = lp.checkpoint()
+            rest = kept[i+1:]
+            for ind in rest:
+                queue.watch_rule(ind)
+            queue.run()
+            redundant = lp.is_complete()
+
+            lp.rollback(mark)
+            for ind in rest:
+                queue.unwatch_rule(ind)
+            if not redundant:
+                queue.watch_rule( kept[i] )
+                queue.run()
+                needed.append( kept[i] )
+
+        return needed
+
+# Generate count puzzles with a unique solution, all from the same generator so the solver state is reused
+def generate_unique_puzzles(count, seed=0, **options):
+    generator = UniquePuzzleGenerator( seed=seed, **options )
+    for i in range(count):
+        yield generator.generate( puzzle_id="{}-{}".format(seed, i) )
@@ -3,16 +3,49 @@ from prettytable import PrettyTable
 import pandas as pd
 from RuleParser import RuleParser, InvalidTokenException, UnexpectedTokenException, MissingTokenException
 from Token import TokenType
+from DomainStore import DomainStore, DomainSetMap
+from PropagationQueue import PropagationQueue
+from Propagator import AIsB, AIsNotB, OneToMany, ManyToMany, AGreaterThanB, MultiExclusion
+from AllDifferent import all_different
+from DifferenceNetwork import DifferenceNetwork
+from Profiler import Profiler, report_table
+from TraceRecorder import TraceRecorder, OTHER, RULE, PASS, PASS_NAMES
 import itertools
+import time
+
+# Raised by solve when its cancel event is set
+class SolveCancelled(Exception):
+    pass
 
 class LogicPuzzle:
+    domain_store = DomainStore              # class used to hold the remaining possibilities, can be swapped out by subclasses
+    rule_types = { 1 : AIsB,                # dict from grammar rule number to the Propagator class it compiles to, see register_rule
+                   2 : AIsNotB,
+                   3 : OneToMany,
+                   4 : ManyToMany,
+                   5 : AGreaterThanB,
+                   6 : MultiExclusion }     # Not fully a rule, just a shorthand for multiple a_is_not_many calls
+
     def __init__(self, category_f_name=None, rule_f_name=None):
         self.categories = []                # list of category titles, first title will be the key category
         self.category_values = {}           # dict from category name to set of values in that category
-        self.full_sets = {}                 # dict from (category_A_name, category_A_value, category_B_name) to set of remaining category_B_values
+        self.element_index = {}             # dict from element token text (value, or category:value) to (category, value)
+        self.ambiguous_values = {}          # dict from value to list of the categories it is in, these need to be written as category:value
+        self.store = None                   # domain store holding one boolean matrix per pair of categories
+        self.full_sets = {}                 # dict-like view from (category_A_name, category_A_value, category_B_name) to set of remaining category_B_values
         self.parser = RuleParser()          # parser to tokenize, and validate rules
         self.rule_f_name = rule_f_name      # File where the rules are stored
-        self.rules = []                     # list of rules. Each rule is a tuple of (function, parameters)
+        self.rules = []                     # list of rules, compiled to Propagators. Each still unpacks to a tuple of (function, parameters)
+        self.propagation = None             # worklist used by solve, built on first use
+        self.rule_marks = {}                # dict from index of a rule added by add_rule to the store checkpoint taken just before it
+        self.matchings = {}                 # dict from (cat_A, cat_B) to the last all-different matching found, to start the next one from
+        self.networks = {}                  # dict from numerical category to (constraints, DifferenceNetwork of those constraints)
+        self.nodes = 0                      # number of guesses made by the last search
+        self.limit_reached = False          # whether the last search ran out of nodes or time
+        self.profiler = None                # Profiler measuring each rule and logic pass while solve(profile=True) runs
+        self.profile_report = None          # report of the last solve(profile=True)
+        self.cancel_event = None            # anything with is_set() (e.g. threading.Event), checked before each rule and logic pass while solve runs
+        self.progress = None                # function called as progress(rounds, remaining) after each sweep or worklist round while solve runs
         self.key_category = None
 
         if not category_f_name is None:
@@ -22,6 +55,22 @@ class LogicPuzzle:
         
         self.create_sets()
     
+    # Build a puzzle from lines of categories and rules already in memory, e.g. from a corpus or a request, without any files
+    # Either can be any iterable of lines, blank lines are skipped
+    @classmethod
+    def from_lines(cls, category_lines, rule_lines=None):
+        lp = cls()
+        lp.set_categories( [ line for line in category_lines if line.strip() != "" ] )
+        if not rule_lines is None:
+            lp.set_rule_lines( list(rule_lines) )
+        lp.create_sets()
+        return lp
+
+    # Same as from_lines, with the categories and rules each given as one string, as they would be in the files
+    @classmethod
+    def from_text(cls, categories, rules=None):
+        return cls.from_lines( categories.splitlines(), None if rules is None else rules.splitlines() )
+
     ##### Setup Functions ##############################################################################################################
 
     def read_categories(self, category_f_name):
@@ -40,20 +89,58 @@ class LogicPuzzle:
         for line in lines:
             row = line.split(":")
             title = row[0].strip()
-            values = set( [ val.strip() for val in row[1].split(",") ] )
+            raw = [ val.strip() for val in row[1].split(",") ]
+            values = set( raw )
 
             # Try to cast values to float, otherwise stay categorical
+            numerical = False
             try:
                 temp = set( [ float(val) for val in values ] )
                 values = temp
+                numerical = True
             except:
                 pass
 
             self.categories.append( title )
             self.category_values[ title ] = values
+            self.index_elements( title, raw, numerical )
             if self.key_category is None:
                 self.key_category = title
 
+    # Add the values of a category to the element index, so tokens are looked up instead of searched for
+    # Every value can be written as category:value, categorical values can also be written on their own,
+    # unless the same value is in more than one category
+    def index_elements(self, title, raw, numerical):
+        for val in raw:
+            el = float(val) if numerical else val
+            self.element_index[ "{}:{}".format(title, val) ] = (title, el)
+            if numerical:
+                continue
+
+            if val in self.ambiguous_values:
+                self.ambiguous_values[val].append( title )
+            elif val in self.element_index and self.element_index[val][0] != title:
+                self.ambiguous_values[val] = [ self.element_index.pop(val)[0], title ]
+            else:
+                self.element_index[val] = (title, el)
+
+    # Return the (category, value) an element token refers to, or None if it isn't a value in the puzzle
+    def find_element(self, text):
+        unit = self.element_index.get(text)
+        if not unit is None or not ":" in text:
+            return unit
+
+        # Numerical values written differently than in the category file (e.g. Price:400.0), remembered for next time
+        cat_A, el_A = text.split(":", 1)
+        try:
+            el_A = float(el_A)
+        except ValueError:
+            return None
+        if cat_A in self.category_values and el_A in self.category_values[cat_A]:
+            self.element_index[text] = (cat_A, el_A)
+            return (cat_A, el_A)
+        return None
+
     def read_rules(self):
         if self.rule_f_name is None:
             return
@@ -61,20 +148,28 @@ class LogicPuzzle:
         validated_rules = self.parser.get_validated_rules(self.rule_f_name, self)
         self.set_rules(validated_rules)
 
-    # Given the validated tokens, build the list of functions calls and parameters to be called each loop
-    def set_rules(self, validated):
-        rule_dict = {}
-        rule_dict[1] = self.a_is_b
-        rule_dict[2] = self.a_is_not_b
-        rule_dict[3] = self.one_to_many
-        rule_dict[4] = self.many_to_many
-        rule_dict[5] = self.a_greater_than_b
-        rule_dict[6] = self.multi_exclusion             # Not fully a rule, just a shorthand for multiple a_is_not_many calls
+    # Plug a new rule type in, rule_number being the number the grammar gives it
+    # Registering on a subclass doesn't change the rule types of LogicPuzzle itself
+    @classmethod
+    def register_rule(cls, rule_number, rule_type):
+        cls.rule_types = dict( cls.rule_types )
+        cls.rule_types[rule_number] = rule_type
 
+    # Read rules from lines of text instead of rule_f_name
+    def set_rule_lines(self, lines):
+        validated_rules = self.parser.get_validated_rule_lines(lines, self)
+        self.set_rules(validated_rules)
+
+    # Given the validated tokens, compile each rule into a Propagator for its rule type
+    def set_rules(self, validated):
         for line in validated:
             ind, args = line
             args = self.extract_params(args)
-            self.rules.append( ( rule_dict[ind], args ) )
+            self.rules.append( self.rule_types[ind](self, args) )
+
+        # The worklist watches the rules, so it has to be rebuilt, and every rule is propagated again from scratch
+        self.propagation = None
+        self.rule_marks = {}
 
     # Take the tokens and pull out the values that will be the parameters
     def extract_params(self, line):
@@ -100,29 +195,32 @@ class LogicPuzzle:
         return params
 
     # Create the initial sets
+    # Every (cat_A, el_A, cat_B) starts with every value of cat_B still possible
     def create_sets(self):
-        for i in range(len(self.categories)):
-            cat_A = self.categories[i]
-            for j in range(len(self.categories))[i+1:]:
-                cat_B = self.categories[j]
-                for val in self.category_values[ cat_A ]:
-                    self.full_sets[ ( cat_A, val, cat_B ) ] = set( self.category_values[ cat_B ] )
-                for val in self.category_values[ cat_B ]:
-                    self.full_sets[ ( cat_B, val, cat_A ) ] = set( self.category_values[ cat_A ] )
+        self.store = self.domain_store( self.categories, self.category_values )
+        self.full_sets = DomainSetMap( self.store )
 
     ##### Auxilliary Functions #########################################################################################################
 
     def clone_sets(self):
         clone = {}
-        for key in self.full_sets:
-            clone[key] = set(self.full_sets[key])
+        for key in self.store.keys():
+            clone[key] = self.store.get(*key)
         return clone
 
     def contains_empty_sets(self):
-        for key in self.full_sets:
-            if self.full_sets[key] == set():
-                return True
-        return False
+        return self.store.contains_empty()
+
+    # Mark the current state of the puzzle, e.g. before trying out a rule or a guess
+    def checkpoint(self):
+        return self.store.checkpoint()
+
+    # Undo everything since checkpoint returned mark, and drop any propagation work that was pending
+    def rollback(self, mark):
+        self.store.rollback(mark)
+        if not self.propagation is None:
+            self.propagation.clear()
+            self.propagation.restore(mark)
 
     # Check the first element of a set (useful when the cardinality of a is 1)
     def peek(a):
@@ -134,19 +232,42 @@ class LogicPuzzle:
     # If val is not None, return a intersect (b + val) and b intersect (a - val)
     def subset(self, a, b, val=None):
         if val is None:
-            sub_a = set( [ x for x in a if x > min(b) ] )
-            sub_b = set( [ x for x in b if x < max(a) ] )
+            low = min(b)
+            high = max(a)
+            sub_a = set( [ x for x in a if x > low ] )
+            sub_b = set( [ x for x in b if x < high ] )
         else:
             sub_a = a & set( [ x+val for x in b ] )
             sub_b = b & set( [ x-val for x in a ] )
         
         return sub_a, sub_b
+
+    # Same as subset, but on boolean rows over the (numerical) values of cat_C in the domain store
+    # Value IDs are in increasing order of value, so a > b only needs the bounds of each row (its first and last True),
+    # and a = b + val maps IDs through the shift tables the store keeps for cat_C
+    def subset_rows(self, cat_C, a, b, val=None):
+        if val is None:
+            sub_a = a & False
+            sub_b = b & False
+            if b.any():
+                low = b.argmax()
+                sub_a[low+1:] = a[low+1:]
+            if a.any():
+                high = len(a) - 1 - a[::-1].argmax()
+                sub_b[:high] = b[:high]
+        else:
+            valid_a, below_a = self.store.shift(cat_C, -val)
+            valid_b, above_b = self.store.shift(cat_C, val)
+            sub_a = a & valid_a & b[below_a]
+            sub_b = b & valid_b & a[above_b]
+
+        return sub_a, sub_b
     
     # Checks how many elements of M_star map to a given category
     def get_possible_M_star(self, cat_A, el_A, M_star):
         possible = []
         for cat_B, el_B in M_star:
-            if (cat_A, el_A, cat_B) in self.full_sets and el_B in self.full_sets[ (cat_A, el_A, cat_B) ]:
+            if (cat_A, el_A, cat_B) in self.store and self.store.contains(cat_A, el_A, cat_B, el_B):
                 possible.append( (cat_B, el_B) )
         return possible
 
@@ -162,13 +283,13 @@ class LogicPuzzle:
         if len(cats) == 1:
             cat_B = cats.pop()
             # Intersect the current set of possibilities with the elements proposed
-            self.full_sets[(cat_A, el_A, cat_B)] &= els
+            self.store.intersect(cat_A, el_A, cat_B, els)
 
             # If there's only one element left, run a_is_b
             # Even though this set is already correct, this call will exclude el_A from the remaining elements
-            if len(self.full_sets[(cat_A, el_A, cat_B)]) == 1:
+            if self.store.row(cat_A, el_A, cat_B).sum() == 1:
                 for el in els:
-                    if not el in self.full_sets[(cat_A, el_A, cat_B)]:
+                    if not self.store.contains(cat_A, el_A, cat_B, el):
                         self.a_is_not_b(cat_A, el_A, cat_B, el)
     
     # Given a list of (cat, el) elements, exclude each (cat_A, el_A) from all other (cat_B, el_B) elements in that list
@@ -185,12 +306,16 @@ class LogicPuzzle:
         if len(possible_M_star) == 1:
             cat_B, el_B = possible_M_star[0]
             self.a_is_b(cat_A, el_A, cat_B, el_B)
+        elif len(possible_M_star) == 0 and len(M_star) > 0:
+            # None of M_star can be el_A anymore, so the rules contradict each other
+            # Empty the set so the contradiction shows up like any other
+            cat_B, el_B = M_star[0]
+            if (cat_A, el_A, cat_B) in self.store:
+                self.store.intersect(cat_A, el_A, cat_B, [])
 
     # Checks the completion of the puzzle
     def is_complete(self):
-        if len( self.full_sets ) == 0:
-            return False
-        return all( [ len( self.full_sets[key] ) == 1 for key in self.full_sets ] )
+        return self.store.is_complete()
     
     ##### Rule Functions ###############################################################################################################
 
@@ -226,34 +351,27 @@ class LogicPuzzle:
     #                           -> (cat_B, el_B, cat_C) = (cat_B, el_B, cat_C) intersect ( (cat_A, el_A, cat_C) - x )
 
     # Rule 1
-    def a_is_b(self, cat_A, el_A, cat_B, el_B, inner=False):
-        if not (cat_A, el_A, cat_B) in self.full_sets:
+    # The reverse, (cat_B, el_B, cat_A) = {el_A}, is the same entry in the domain store
+    def a_is_b(self, cat_A, el_A, cat_B, el_B):
+        if not (cat_A, el_A, cat_B) in self.store:
             return
 
-        self.full_sets[ (cat_A, el_A, cat_B) ] = set([el_B])
-        for val in self.category_values[cat_A]:
-            if val != el_A:
-                self.a_is_not_b(cat_A, val, cat_B, el_B)
-        
-        # Apply the reverse, set inner to True so the recursion ends
-        if not inner:
-            self.a_is_b(cat_B, el_B, cat_A, el_A, inner=True)
+        # (cat_A, el_A, cat_B) = {el_B}, and el_B is removed from every other (cat_A, val, cat_B)
+        self.store.link(cat_A, el_A, cat_B, el_B)
     
     # Rule 2
-    def a_is_not_b(self, cat_A, el_A, cat_B, el_B, inner=False):
-        if not (cat_A, el_A, cat_B) in self.full_sets:
+    # The reverse, (cat_B, el_B, cat_A) -= {el_A}, is the same entry in the domain store
+    def a_is_not_b(self, cat_A, el_A, cat_B, el_B):
+        if not (cat_A, el_A, cat_B) in self.store:
             return
             
-        self.full_sets[ (cat_A, el_A, cat_B) ] -= set([el_B])
-
-        if not inner:
-            self.a_is_not_b(cat_B, el_B, cat_A, el_A, inner=True)
+        self.store.unlink(cat_A, el_A, cat_B, el_B)
 
     # Rule 3
     def one_to_many(self, cat_A, el_A, M_star:list) -> None:
         # Make sure cat_A, el_A can actually map to all cat_B in M_star
         for cat_B, el_B in M_star:
-            if not (cat_A, el_A, cat_B) in self.full_sets:
+            if not (cat_A, el_A, cat_B) in self.store:
                 return
 
         # Elements in the same list cannot be each other
@@ -266,9 +384,6 @@ class LogicPuzzle:
         # If this set is only one element, set it
         # Unfortunately, this will be redundant in the case than all categories are the same (since check_single_category has been run)
         self.check_possibilities(cat_A, el_A, M_star)
-
-        self.reflexive_inclusion()
-        self.reflexive_exclusion()
     
     # Rule 4
     # Given a list of (category, element) tuples (N_star), and a similar list for M_star
@@ -285,132 +400,422 @@ class LogicPuzzle:
     # Assuming (cat_A, el_A, cat_C) is the set said to be larger than (cat_B, el_B, cat_C)
     def a_greater_than_b(self, cat_A, el_A, cat_B, el_B, cat_C, val=None):
         self.a_is_not_b(cat_A, el_A, cat_B, el_B)
-        sub_a, sub_b = self.subset( self.full_sets[ (cat_A, el_A, cat_C) ], 
-                                    self.full_sets[ (cat_B, el_B, cat_C) ], 
-                                    val=val )
-        self.full_sets[ (cat_A, el_A, cat_C) ] = sub_a
-        self.full_sets[ (cat_B, el_B, cat_C) ] = sub_b
-
-        self.reflexive_inclusion()
-        self.reflexive_exclusion()
+        sub_a, sub_b = self.subset_rows( cat_C,
+                                         self.store.row(cat_A, el_A, cat_C),
+                                         self.store.row(cat_B, el_B, cat_C),
+                                         val=val )
+        self.store.restrict_row( cat_A, self.store.ids[cat_A][el_A], cat_C, sub_a )
+        self.store.restrict_row( cat_B, self.store.ids[cat_B][el_B], cat_C, sub_b )
+
+        # Settle any of the sets this rule narrowed down to one element
+        for key in [ (cat_A, el_A, cat_B), (cat_A, el_A, cat_C), (cat_B, el_B, cat_C) ]:
+            if key in self.store:
+                self.reflexive_inclusion_key(*key)
 
     ##### General Logic Functions ######################################################################################################
 
     # Run all the loaded rules
     def rule_sweep(self, intermediate_logic=True):
-        for func, params in self.rules:
-            func(*params)
+        for ind in range(len(self.rules)):
+            self.run_rule(ind)
 
             if intermediate_logic:
                 # Run logic between each evaluation of rules
                 self.logic_sweep()
 
     # Run all logic functions
+    # The reflexive functions aren't needed, the domain store keeps both directions in sync and n_of_n settles single elements
     def logic_sweep(self):
-        self.reflexive_inclusion()
-        self.reflexive_exclusion()
-        self.link_inclusion()
-        self.link_exclusion()
-        self.n_of_n()
+        self.run_pass("link_inclusion")
+        self.run_pass("link_exclusion")
+        self.run_pass("n_of_n")
+        self.run_pass("difference_bounds")
+
+    # Stop solving if the cancel event given to solve has been set
+    def check_cancelled(self):
+        if not self.cancel_event is None and self.cancel_event.is_set():
+            raise SolveCancelled("Solve was cancelled")
+
+    def report_progress(self, rounds):
+        if not self.progress is None:
+            self.progress( rounds, self.store.remaining() )
+
+    # Run the rule with index ind, measured by the profiler and attributed in the trace when those are on
+    def run_rule(self, ind):
+        self.check_cancelled()
+        recorder = self.store.recorder
+        if not recorder is None:
+            recorder.set_cause(RULE, ind)
+        if self.profiler is None:
+            self.rules[ind].propagate()
+        else:
+            self.profiler.measure_rule(ind, self.rules[ind])
+        if not recorder is None:
+            recorder.set_cause(OTHER)
+
+    # Run the logic function called name, the same way as run_rule
+    def run_pass(self, name, *params):
+        self.check_cancelled()
+        recorder = self.store.recorder
+        if not recorder is None:
+            recorder.set_cause( PASS, PASS_NAMES.index( Profiler.pass_names.get(name, name) ) )
+        if self.profiler is None:
+            getattr(self, name)(*params)
+        else:
+            self.profiler.measure_pass( name, getattr(self, name), *params )
+        if not recorder is None:
+            recorder.set_cause(OTHER)
 
     # If (cat_A, el_A, cat_B) = el_B, then (cat_B, el_B, cat_A) = el_A
+    # and el_B can be removed from every other (cat_A, val, cat_B)
     def reflexive_inclusion(self):
+        for cat_A, el_A, cat_B in self.store.keys():
+            self.reflexive_inclusion_key(cat_A, el_A, cat_B)
 
-        for cat_A, el_A, cat_B in self.full_sets:
-            els = self.full_sets[(cat_A, el_A, cat_B)]
-
-            # If the set of possibilities is only one element long, it is solved and that element must also
-            # have a reflexive relation back on el_A
-            if len(els) == 1:
-                el_B = LogicPuzzle.peek(els)
-                self.a_is_b(cat_B, el_B, cat_A, el_A)
-    
-    # If (cat_A, el_A, cat_B) can't be el_B, that means (cat_B, el_B, cat_A) can't be el_A
-    def reflexive_exclusion(self):
-
-        for cat_A, el_A, cat_B in self.full_sets:
-            els = self.full_sets[(cat_A, el_A, cat_B)]
-            universal = self.category_values[cat_B]             # All the possible values in cat_B
-            excluded = universal - els                          # The elements in cat_B that are no longer possibly linked to el_B
-            
-            for el_B in excluded:
-                self.a_is_not_b(cat_B, el_B, cat_A, el_A)
+    def reflexive_inclusion_key(self, cat_A, el_A, cat_B):
+        row = self.store.row(cat_A, el_A, cat_B)
+        if row.sum() == 1:
+            self.a_is_b(cat_A, el_A, cat_B, self.store.values[cat_B][ np.argmax(row) ])
     
     # If (cat_A, el_A, cat_B) = el_B, and (cat_B, el_B, cat_C) = el_C, then (cat_A, el_A, cat_C) = el_C
     # A broader way of characterizing this is:
     # (cat_A, el_A, cat_C) = (cat_A, el_A, cat_C) intersect ( set() union (cat_B, el_B, cat_C) union ... )
     # for all el_B in (cat_A, el_A, cat_B)
     def link_inclusion(self):
-        
         for cat_A, cat_B, cat_C in itertools.permutations(self.categories,3):
-            for el_A in self.category_values[cat_A]:
-                seed = set()
-                for el_B in self.full_sets[(cat_A, el_A, cat_B)]:
-                    seed |= self.full_sets[(cat_B, el_B, cat_C)]
-                self.full_sets[(cat_A, el_A, cat_C)] &= seed
+            self.link_inclusion_triple(cat_A, cat_B, cat_C)
+
+    # As a boolean matrix product, row el_A of (m_AB @ m_BC) is the union of (cat_B, el_B, cat_C) for el_B in (cat_A, el_A, cat_B)
+    def link_inclusion_triple(self, cat_A, cat_B, cat_C):
+        m_AB = self.store.matrix(cat_A, cat_B)
+        m_BC = self.store.matrix(cat_B, cat_C)
+        self.store.restrict(cat_A, cat_C, m_AB @ m_BC)
                         
     # If el_B is not in (cat_A, el_A, cat_B), and (cat_B, el_B, cat_C) = el_C
     # then (cat_A, el_A, cat_C) -= (cat_B_, el_B, cat_C)
     def link_exclusion(self):
-        
         for cat_A, cat_B, cat_C in itertools.permutations(self.categories,3):
-            universal_B = self.category_values[cat_B]
-            for el_A in self.category_values[cat_A]:
-                for el_B in (universal_B - self.full_sets[(cat_A, el_A, cat_B)]):
-                    c_set = self.full_sets[(cat_B, el_B, cat_C)]
-                    if len(c_set) == 1:
-                        # If A,a1 is not B,b1, but we know B,b1 is C,c1, then we know A,a1 cannot be C,c1
-                        self.full_sets[(cat_A, el_A, cat_C)] -= c_set
+            self.link_exclusion_triple(cat_A, cat_B, cat_C)
+
+    # As a boolean matrix product, only counting the el_B that are solved
+    def link_exclusion_triple(self, cat_A, cat_B, cat_C):
+        m_AB = self.store.matrix(cat_A, cat_B)
+        m_BC = self.store.matrix(cat_B, cat_C)
+        solved_B = m_BC.sum(axis=1) == 1
+        # If A,a1 is not B,b1, but we know B,b1 is C,c1, then we know A,a1 cannot be C,c1
+        excluded = ~m_AB & solved_B
+        self.store.restrict(cat_A, cat_C, ~( excluded @ m_BC ))
 
     # If n (of el_A) sets in (cat_A, el_A, cat_B) have the same n values, then exclude those n values from the remaining el_A values
+    # This is done with all-different filtering on each pair of categories, which finds every such group of n sets
+    # (not only identical ones) in a single call
     def n_of_n(self):
-        for cat_A, cat_B in itertools.permutations(self.categories,2):
-            max_els = len( self.category_values[cat_B] )
-            n_sets = {}
-            for el_A in self.category_values[cat_A]:
-                key = (cat_A,el_A,cat_B)
-                temp = tuple(self.full_sets[key])
-                if len(temp) == max_els:
-                    continue
-                if not temp in n_sets:
-                    n_sets[temp] = set( self.category_values[cat_A] )
-                
-                n_sets[temp].remove( el_A )
-
-            for element_set in n_sets:
-                key_sets = n_sets[element_set]
-                if len(key_sets) == max_els - len(element_set):
-                    for el_A in key_sets:
-                        for el_B in element_set:
-                            #print( " - ".join([str(cat_A), str(el_A), str(cat_B), str(el_B)]) )
-                            self.a_is_not_b(cat_A, el_A, cat_B, el_B)
-    
-    ##### GAMEPLAY #####################################################################################################################
+        for cat_A, cat_B in self.store.matrices:
+            self.all_different_pair(cat_A, cat_B)
+
+    # Each el_A is a different el_B, so every possibility has to be part of a one-to-one matching of cat_A to cat_B
+    # Possibilities that aren't in any such matching are removed, and if there is no matching at all every set is emptied
+    def all_different_pair(self, cat_A, cat_B):
+        m = self.store.matrix(cat_A, cat_B)
+        if m.shape[0] != m.shape[1]:
+            return
 
-    def solve(self, intermediate_logic=True, show=True, return_results=False):
-        changed = True
-        sweeps = 0
+        supported, self.matchings[ (cat_A, cat_B) ] = all_different( m, self.matchings.get( (cat_A, cat_B) ) )
+        self.store.restrict(cat_A, cat_B, supported)
+
+    # Categories whose values are all numbers, the ones rule 5 compares on
+    def numerical_categories(self):
+        return [ cat for cat in self.categories if all( [ isinstance(val, float) for val in self.category_values[cat] ] ) ]
+
+    # Indices of the rule 5 rules comparing on cat_C, only the ones the worklist is watching once it has been built
+    def difference_rules(self, cat_C):
+        active = None if self.propagation is None else self.propagation.active
+        return tuple( [ ind for ind, rule in enumerate(self.rules)
+                        if isinstance(rule, AGreaterThanB) and rule.params[4] == cat_C and ( active is None or ind in active ) ] )
+
+    # The difference network of the rule 5 rules comparing on cat_C, only rebuilt when those rules change
+    # The cache is keyed on the constraints themselves rather than on rule indices, since rules can be replaced by
+    # different rules at the same indices (e.g. UniquePuzzleGenerator.reset), and on the values of the store
+    def difference_network(self, cat_C):
+        constraints = []
+        for ind in self.difference_rules(cat_C):
+            rule = self.rules[ind]
+            if len( rule.reads() ) == 2:
+                constraints.append( tuple( rule.params[:4] ) + ( rule.params[5] if len(rule.params) > 5 else None, ) )
+        constraints = tuple(constraints)
+        values = self.store.numeric(cat_C)
+        cached = self.networks.get(cat_C)
+        if cached is None or cached[0] != constraints or cached[1].values is not values:
+            self.networks[cat_C] = ( constraints, DifferenceNetwork( values, constraints ) )
+        return self.networks[cat_C][1]
+
+    # Tighten the values left for every element compared on a numerical category by all the rule 5 rules on it at once,
+    # instead of one rule at a time over many sweeps
+    def difference_bounds(self):
+        for cat_C in self.numerical_categories():
+            self.difference_bounds_category(cat_C)
+
+    # Bounds are taken from the smallest and largest value left in each (cat_A, el_A, cat_C), which can leave a gap
+    # at the new bounds, so this repeats until the bounds hold. Rules that can't all hold empty every set they compare
+    def difference_bounds_category(self, cat_C):
+        network = self.difference_network(cat_C)
+        if len(network) == 0:
+            return
+        keys = [ (cat_A, el_A, cat_C) for cat_A, el_A in network.nodes ]
+        if not network.feasible:
+            for key in keys:
+                self.store.intersect(*key, [])
+            return
 
+        values = network.values
+        changed = True
         while changed:
-            prev = self.clone_sets()
-            self.rule_sweep(intermediate_logic)
-            if not intermediate_logic:
-                self.logic_sweep()                      # No need to do this if I'm running it after each rule
-            changed = ( prev != self.full_sets )
-            sweeps += 1
-            if self.is_complete():
+            rows = [ self.store.row(*key) for key in keys ]
+            if not all( [ row.any() for row in rows ] ):
+                return
+            lower = np.array( [ values[ row.argmax() ] for row in rows ] )
+            upper = np.array( [ values[ len(row) - 1 - row[::-1].argmax() ] for row in rows ] )
+            new_lower, new_upper = network.bounds(lower, upper)
+
+            changed = False
+            for k in np.flatnonzero( ( new_lower > lower + network.tolerance ) | ( new_upper < upper - network.tolerance ) ):
+                cat_A, el_A, cat_C = keys[k]
+                changed |= self.store.restrict_row( cat_A, self.store.ids[cat_A][el_A], cat_C, network.between( new_lower[k], new_upper[k] ) )
+
+    ##### Propagation ##################################################################################################################
+
+    # Run the rules and logic functions from a worklist until nothing is left to do
+    # Returns the number of rounds it took
+    def propagate(self):
+        if self.propagation is None or self.propagation.store is not self.store:
+            self.propagation = PropagationQueue(self)
+        self.propagation.push_all()
+        return self.propagation.run()
+
+    ##### Editing ######################################################################################################################
+
+    # Add one rule (a line of rule text) to a puzzle that has already been propagated, returns its index in rules
+    # Only the new rule is propagated, on top of the fixed point of the rules before it. The state just before is kept
+    # as a checkpoint, so remove_rule can go back to it
+    def add_rule(self, text):
+        validated = self.parser.get_validated_rule_lines( [text], self )
+        if len(validated) != 1:
+            raise ValueError( "Expected one rule, got {}: {}".format( len(validated), text.strip() ) )
+        if self.propagation is None or self.propagation.store is not self.store:
+            self.propagate()
+
+        rule_number, args = validated[0]
+        mark = self.checkpoint()
+        self.rules.append( self.rule_types[rule_number](self, self.extract_params(args)) )
+        ind = len(self.rules) - 1
+        self.rule_marks[ind] = mark
+        self.propagation.watch_rule(ind)
+        self.propagation.run()
+        return ind
+
+    # Remove the rule at index ind, the rules after it move down one index like in a list
+    # The store is rolled back to the checkpoint taken before the rule was added, the last state that didn't depend on it,
+    # and only the rules added after it are propagated again, each from a new checkpoint. Removing one of the rules the
+    # puzzle started with goes back to the start and propagates everything else
+    def remove_rule(self, ind):
+        if ind < 0 or ind >= len(self.rules):
+            raise IndexError( "No rule {}".format(ind) )
+        if self.propagation is None or self.propagation.store is not self.store:
+            self.propagate()
+
+        mark = self.rule_marks.get(ind, 0)
+        later = sorted( [ i for i in self.rule_marks if self.rule_marks[i] >= mark and i != ind ] )
+        base = not ind in self.rule_marks
+        self.rollback(mark)
+
+        del self.rules[ind]
+        shift = lambda i: i - 1 if i > ind else i
+        self.rule_marks = { shift(i) : m for i, m in self.rule_marks.items() if i != ind }
+        later = [ shift(i) for i in later ]
+        # Indices changed, so the worklist and the cached difference networks are rebuilt for the remaining rules
+        self.propagation = PropagationQueue(self)
+        self.networks = {}
+
+        for i in later:
+            self.propagation.unwatch_rule(i)
+        if base:
+            self.propagation.push_all()
+            self.propagation.run()
+        for i in later:
+            self.rule_marks[i] = self.checkpoint()
+            self.propagation.watch_rule(i)
+            self.propagation.run()
+
+    ##### Tracing ####################################################################################################################
+
+    # Record every deduction from here on in a ring buffer of capacity events (see TraceRecorder)
+    def start_trace(self, capacity=65536):
+        self.store.recorder = TraceRecorder(self.store, capacity)
+        return self.store.recorder
+
+    # Stop recording, and return the recorder with the events
+    def stop_trace(self):
+        recorder = self.store.recorder
+        self.store.recorder = None
+        return recorder
+
+    ##### Search #######################################################################################################################
+
+    # The undecided (cat_A, el_A, cat_B) with the fewest possibilities left
+    def smallest_domain(self):
+        best = None
+        best_size = None
+        for cat_A, cat_B in self.store.pairs():
+            sizes = self.store.matrix(cat_A, cat_B).sum(axis=1)
+            open_rows = np.flatnonzero(sizes > 1)
+            if len(open_rows) == 0:
+                continue
+            i = open_rows[ np.argmin( sizes[open_rows] ) ]
+            if best_size is None or sizes[i] < best_size:
+                best = (cat_A, self.store.values[cat_A][i], cat_B)
+                best_size = sizes[i]
+        return best
+
+    # When propagation stalls, guess el_A is el_B for the smallest undecided set and propagate from there
+    # Returns True if a solution was found (and left in the store), otherwise the store is left as it was
+    def search(self, node_limit=None, time_limit=None):
+        self.propagate()
+        self.nodes = 0
+        self.limit_reached = False
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+
+        start = self.checkpoint()
+        found = next( self.solutions(node_limit, deadline), False )
+        if not found:
+            self.rollback(start)
+        return found
+
+    # Yields True for every solution the guesses reach from the current state, with the solution in the store meanwhile
+    # Guesses el_A is el_B for the smallest undecided set, then el_A is not el_B once that's undone, so the same
+    # propagation state is reused for every branch. Stopping the iteration leaves the last solution in the store, running
+    # it to the end leaves the store as it was. If node_limit or deadline run out first, limit_reached is set
+    def solutions(self, node_limit, deadline):
+        if self.propagation.failed or self.store.contains_empty():
+            return
+        if self.is_complete():
+            yield True
+            return
+        if ( not node_limit is None and self.nodes >= node_limit ) or ( not deadline is None and time.perf_counter() > deadline ):
+            self.limit_reached = True
+            return
+
+        undecided = self.smallest_domain()
+        if undecided is None:
+            return
+        cat_A, el_A, cat_B = undecided
+        el_B = self.store.values[cat_B][ np.argmax( self.store.row(cat_A, el_A, cat_B) ) ]
+        self.nodes += 1
+
+        mark = self.checkpoint()
+        self.propagation.assume(self.a_is_b, cat_A, el_A, cat_B, el_B)
+        yield from self.solutions(node_limit, deadline)
+        self.rollback(mark)
+        if self.limit_reached:
+            return
+
+        self.propagation.assume(self.a_is_not_b, cat_A, el_A, cat_B, el_B)
+        yield from self.solutions(node_limit, deadline)
+        self.rollback(mark)
+
+    # Number of solutions the rules allow, counting stops once limit solutions are found (limit=None counts them all)
+    # Uses the same guesses as search, so the store is left as it was
+    # If node_limit or time_limit run out first, limit_reached is set and the count is only a lower bound
+    def count_solutions(self, limit=2, node_limit=None, time_limit=None):
+        self.nodes = 0
+        self.limit_reached = False
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+
+        start = self.checkpoint()
+        self.propagate()
+        count = 0
+        for _ in self.solutions(node_limit, deadline):
+            count += 1
+            if not limit is None and count >= limit:
                 break
+        self.rollback(start)
+        return count
+
+    # Whether the rules allow exactly one solution, stops as soon as a second one is found
+    # None if node_limit or time_limit ran out before that could be decided
+    def is_unique(self, node_limit=None, time_limit=None):
+        count = self.count_solutions(2, node_limit, time_limit)
+        if self.limit_reached and count < 2:
+            return None
+        return count == 1
+
+    ##### GAMEPLAY #####################################################################################################################
+
+    # worklist=True only reruns the rules and logic functions affected by each change (see propagate)
+    # worklist=False sweeps every rule and logic function until a whole sweep changes nothing
+    # search=True falls back on search when deduction alone can't finish the puzzle, limited by node_limit guesses and time_limit seconds
+    # profile=True measures the calls, time and possibilities removed for each rule and logic pass (see Profiler.report)
+    # The report is kept in profile_report, and added to what solve returns
+    # progress is called as progress(rounds, remaining) after every sweep or worklist round, remaining being the possibilities left
+    # cancel is anything with is_set() (e.g. a threading.Event set from another thread), once set solve raises SolveCancelled
+    # before the next rule or logic pass, leaving the puzzle partly solved
+    def solve(self, intermediate_logic=True, show=True, return_results=False, worklist=True, search=False, node_limit=None, time_limit=None, profile=False,
+              progress=None, cancel=None):
+        if profile:
+            self.profiler = Profiler(self)
+        self.progress = progress
+        self.cancel_event = cancel
+        try:
+            if worklist:
+                sweeps = self.propagate()
+            else:
+                sweeps = self.sweep_solve(intermediate_logic)
+
+            if search and not self.is_complete():
+                self.search(node_limit, time_limit)
+        finally:
+            self.progress = None
+            self.cancel_event = None
+            if profile:
+                self.profile_report = self.profiler.report()
+                self.profiler = None
         
         if show:
             print("Iterations: ",sweeps)
+            if search:
+                print("Search nodes: ",self.nodes)
             if self.is_complete():
                 print("Solved!")
                 self.show_grid()
             else:
                 print("Not solved...")
+            if profile:
+                print( report_table(self.profile_report) )
 
+        if return_results and profile:
+            return self.is_complete(), sweeps, self.get_printable_grid(), self.profile_report
         if return_results:
             return self.is_complete(), sweeps, self.get_printable_grid()
+        if profile:
+            return self.profile_report
+
+    def sweep_solve(self, intermediate_logic=True):
+        changed = True
+        sweeps = 0
+
+        while changed:
+            if not self.store.recorder is None:
+                self.store.recorder.next_sweep()
+            mark = self.checkpoint()
+            self.rule_sweep(intermediate_logic)
+            if not intermediate_logic:
+                self.logic_sweep()                      # No need to do this if I'm running it after each rule
+            changed = self.store.changed_since(mark)
+            sweeps += 1
+            self.report_progress(sweeps)
+            if self.is_complete():
+                break
+
+        return sweeps
 
     def get_grid(self, separate_title=False):
         if self.key_category is None:
@@ -421,13 +826,15 @@ class LogicPuzzle:
             if title != self.key_category:
                 titles.append( title )
         
-        data = [ [ str(val) for val in self.category_values[self.key_category] ] ]
+        key_values = self.store.values[self.key_category]
+        data = [ [ str(val) for val in key_values ] ]
         for category in titles[1:]:
+            m = self.store.matrix(self.key_category, category)
+            values = self.store.values[category]
             row = []
-            for key_element in self.category_values[self.key_category]:
-                res = self.full_sets[(self.key_category, key_element, category)]
-                if len(res) == 1:
-                    row.append( str( LogicPuzzle.peek(res) ) )
+            for i in range(len(key_values)):
+                if m[i].sum() == 1:
+                    row.append( str( values[ np.argmax(m[i]) ] ) )
                 else:
                     row.append( "" )
             data.append(row)
@@ -435,7 +842,7 @@ class LogicPuzzle:
         data = np.array(data).T
         if separate_title:
             return titles, data
-        return np.vstack([title,data])
+        return np.vstack([titles,data])
 
     def get_printable_grid(self):
         titles, data = self.get_grid(separate_title=True)
@@ -0,0 +1,65 @@
+import time
+from prettytable import PrettyTable
+
+# Opt-in instrumentation for LogicPuzzle.solve, see solve(profile=True)
+# Records the calls, wall time and possibilities removed by each rule and each logic pass
+# The solver only checks whether a profiler is set before each rule or pass, so leaving it off costs next to nothing
+class Profiler:
+    # Logic functions the worklist runs for a single pair or triple of categories, counted under the pass they belong to
+    pass_names = { "link_inclusion_triple" : "link_inclusion",
+                   "link_exclusion_triple" : "link_exclusion",
+                   "all_different_pair" : "n_of_n",
+                   "difference_bounds_category" : "difference_bounds" }
+
+    def __init__(self, puzzle):
+        self.puzzle = puzzle
+        self.rules = {}                     # dict from rule index to [calls, seconds, pruned]
+        self.passes = {}                    # dict from logic pass name to [calls, seconds, pruned]
+        self.start = time.perf_counter()
+
+    # Possibilities removed since the trail had mark entries, each removed cell is one value of both (cat_A, el_A, cat_B) and (cat_B, el_B, cat_A)
+    def pruned_since(self, mark):
+        trail = self.puzzle.store.trail
+        return sum( [ len(flip_rows) for pair, flip_rows, flip_cols in trail[mark:] ] )
+
+    def measure(self, stats, key, func, *params):
+        mark = len(self.puzzle.store.trail)
+        start = time.perf_counter()
+        func(*params)
+        elapsed = time.perf_counter() - start
+
+        entry = stats.setdefault( key, [0, 0.0, 0] )
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += self.pruned_since(mark)
+
+    def measure_rule(self, ind, rule):
+        self.measure( self.rules, ind, rule.propagate )
+
+    def measure_pass(self, name, func, *params):
+        self.measure( self.passes, self.pass_names.get(name, name), func, *params )
+
+    # Structured report of everything measured
+    #   total_time  -> seconds since the profiler was started
+    #   rules       -> list of dicts (index, rule, calls, time, pruned), one per rule that ran, slowest first
+    #   passes      -> dict from logic pass name to dict of calls, time, pruned
+    def report(self):
+        rules = []
+        for ind, (calls, elapsed, pruned) in self.rules.items():
+            rules.append( { "index" : ind, "rule" : repr( self.puzzle.rules[ind] ), "calls" : calls, "time" : elapsed, "pruned" : pruned } )
+        rules.sort( key=lambda entry: -entry["time"] )
+
+        passes = {}
+        for name, (calls, elapsed, pruned) in self.passes.items():
+            passes[name] = { "calls" : calls, "time" : elapsed, "pruned" : pruned }
+
+        return { "total_time" : time.perf_counter() - self.start, "rules" : rules, "passes" : passes }
+
+# Table of a profiling report, passes first, then rules slowest first
+def report_table(report):
+    tab = PrettyTable( ["Rule / pass", "Calls", "Time (ms)", "Pruned"] )
+    for name, entry in report["passes"].items():
+        tab.add_row( [ name, entry["calls"], "{:.3f}".format( 1000 * entry["time"] ), entry["pruned"] ] )
+    for entry in report["rules"]:
+        tab.add_row( [ "{}: {}".format( entry["index"], entry["rule"] ), entry["calls"], "{:.3f}".format( 1000 * entry["time"] ), entry["pruned"] ] )
+    return tab
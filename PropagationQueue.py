@@ -0,0 +1,172 @@
+from collections import deque
+from TraceRecorder import SEARCH, OTHER
+from contextlib import contextmanager
+
+# AC-3 style worklist for a LogicPuzzle
+# Every change to the domain store queues only the rules watching the changed (cat_A, el_A, cat_B) keys, and the
+# logic functions for the category pairs/triples that read the changed matrix. Solving ends when the queue is empty.
+# Tasks are tuples, either ("rule", index) or (logic function name, cat_A, cat_B[, cat_C])
+# Rules that are entailed after they run are retired, and skipped until a rollback undoes the changes that entailed them
+class PropagationQueue:
+    def __init__(self, puzzle):
+        self.puzzle = puzzle
+        self.store = puzzle.store
+        self.queue = deque()                # tasks waiting to run, in order
+        self.queued = set()                 # same tasks as queue, for quick membership checks
+        self.watchers = {}                  # dict from (cat_A, cat_B) to dict from row ID to list of rule indices
+        self.pair_tasks = {}                # dict from stored (cat_A, cat_B) to list of logic tasks reading that matrix (in either direction)
+        self.failed = False                 # set when a change leaves a (cat_A, el_A, cat_B) with no possibilities
+        self.retired = {}                   # dict from index of an entailed rule to the store checkpoint it was entailed at
+        self.active = set()                 # indices of the rules being propagated
+        self.numerical = set( puzzle.numerical_categories() )
+        self.tasks_run = 0
+
+        self.set_watchers()
+        self.set_pair_tasks()
+        # The store may be empty somewhere already, e.g. after a sweep solve found a contradiction
+        self.failed = self.store.contains_empty()
+
+    # Map each watched key to the rules watching it
+    def set_watchers(self):
+        for ind in range(len(self.puzzle.rules)):
+            self.add_watchers(ind)
+
+    def add_watchers(self, ind):
+        self.active.add(ind)
+        for cat_A, el_A, cat_B in self.puzzle.rules[ind].reads():
+            rows = self.watchers.setdefault( (cat_A, cat_B), {} )
+            rows.setdefault( self.store.ids[cat_A][el_A], [] ).append( ind )
+
+    # Start propagating a rule added to the puzzle after the queue was built
+    # The difference bounds read by the rule are queued too, the rule may be a new constraint for them
+    def watch_rule(self, ind):
+        self.add_watchers(ind)
+        self.push( ("rule", ind) )
+        for cat_A, el_A, cat_B in self.puzzle.rules[ind].reads():
+            if cat_B in self.numerical:
+                self.push( ("difference_bounds_category", cat_B) )
+
+    # Stop propagating a rule, what it already removed stays removed until a rollback
+    def unwatch_rule(self, ind):
+        for cat_A, el_A, cat_B in self.puzzle.rules[ind].reads():
+            rows = self.watchers[ (cat_A, cat_B) ][ self.store.ids[cat_A][el_A] ]
+            if ind in rows:
+                rows.remove(ind)
+        self.active.discard(ind)
+        self.retired.pop(ind, None)
+        task = ("rule", ind)
+        if task in self.queued:
+            self.queued.remove(task)
+            self.queue.remove(task)
+
+    # Map each stored matrix to the logic functions that read it
+    def set_pair_tasks(self):
+        categories = self.puzzle.categories
+        for pair in self.store.matrices:
+            tasks = [ ("all_different_pair",) + pair ]
+            tasks.extend( [ ("difference_bounds_category", cat) for cat in pair if cat in self.numerical ] )
+            # Either direction of the pair is either the first or the second link of a chain
+            for cat_A, cat_B in [ pair, pair[::-1] ]:
+                for cat_C in categories:
+                    if cat_C != cat_A and cat_C != cat_B:
+                        tasks.append( ("link_inclusion_triple", cat_A, cat_B, cat_C) )
+                        tasks.append( ("link_exclusion_triple", cat_A, cat_B, cat_C) )
+                        tasks.append( ("link_inclusion_triple", cat_C, cat_A, cat_B) )
+                        tasks.append( ("link_exclusion_triple", cat_C, cat_A, cat_B) )
+            self.pair_tasks[pair] = tasks
+
+    def push(self, task):
+        if task[0] == "rule" and task[1] in self.retired:
+            return
+        if not task in self.queued:
+            self.queued.add(task)
+            self.queue.append(task)
+
+    # Queue every rule being propagated and every logic function
+    def push_all(self):
+        for ind in range(len(self.puzzle.rules)):
+            if ind in self.active:
+                self.push( ("rule", ind) )
+        for tasks in self.pair_tasks.values():
+            for task in tasks:
+                self.push(task)
+
+    # Called by the domain store whenever rows and columns of the stored (cat_A, cat_B) matrix change
+    # Changed row el_A is the key (cat_A, el_A, cat_B), changed column el_B is the key (cat_B, el_B, cat_A)
+    def on_change(self, cat_A, cat_B, rows, cols):
+        for cat_X, cat_Y, ids in [ (cat_A, cat_B, rows), (cat_B, cat_A, cols) ]:
+            m = self.store.matrix(cat_X, cat_Y)
+            watched = self.watchers.get( (cat_X, cat_Y) )
+            for i in ids:
+                if not m[i].any():
+                    self.failed = True
+                if watched and i in watched:
+                    for ind in watched[i]:
+                        self.push( ("rule", ind) )
+
+        for task in self.pair_tasks[ (cat_A, cat_B) ]:
+            self.push(task)
+
+    def run_task(self, task):
+        if task[0] == "rule":
+            self.puzzle.run_rule( task[1] )
+            if self.puzzle.rules[ task[1] ].entailed():
+                self.retired[ task[1] ] = self.store.checkpoint()
+        else:
+            self.puzzle.run_pass( *task )
+        self.tasks_run += 1
+
+    # Queue tasks for every change made to the store inside the with block
+    @contextmanager
+    def watching(self):
+        if self.on_change in self.store.listeners:
+            yield
+            return
+
+        self.store.listeners.append(self.on_change)
+        try:
+            yield
+        finally:
+            self.store.listeners.remove(self.on_change)
+
+    # Run queued tasks until the queue is empty or a contradiction is found
+    # Tasks left over once the puzzle is complete still run, so a rule the solution breaks empties a set
+    # A round is every task that was queued when the round started, so the count is comparable to the number of sweeps
+    def run(self):
+        rounds = 0
+        with self.watching():
+            while self.queue and not self.failed:
+                rounds += 1
+                if not self.store.recorder is None:
+                    self.store.recorder.next_sweep()
+                for _ in range(len(self.queue)):
+                    task = self.queue.popleft()
+                    self.queued.remove(task)
+                    self.run_task(task)
+                    if self.failed:
+                        break
+                self.puzzle.report_progress(rounds)
+
+        return rounds
+
+    # Make a change with func(*params) and propagate only from what it changed
+    def assume(self, func, *params):
+        recorder = self.store.recorder
+        if not recorder is None:
+            recorder.set_cause(SEARCH)
+        with self.watching():
+            func(*params)
+        if not recorder is None:
+            recorder.set_cause(OTHER)
+        return self.run()
+
+    # Drop pending work, failed is worked out again from the store, which may have been empty already before any change
+    def clear(self):
+        self.queue.clear()
+        self.queued.clear()
+        self.failed = self.store.contains_empty()
+
+    # After the store is rolled back to mark, bring back the rules that were only entailed by the changes undone
+    def restore(self, mark):
+        for ind in [ ind for ind, entailed_at in self.retired.items() if entailed_at > mark ]:
+            del self.retired[ind]
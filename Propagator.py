@@ -0,0 +1,196 @@
+import itertools
+
+# Compiled rules for a LogicPuzzle
+# Each validated rule becomes a Propagator, which knows the (cat_A, el_A, cat_B) keys it reads and writes, and whether it is
+# entailed (it holds for every combination still possible, so running it again can't change anything)
+# A propagator still unpacks as the old (function, parameters) tuple, so rule[0] is the rule function and rule[1] its parameters
+class Propagator:
+    method = None                           # name of the LogicPuzzle rule function called by propagate, new rule types can override propagate instead
+
+    def __init__(self, puzzle, params):
+        self.puzzle = puzzle
+        self.params = params
+
+    @property
+    def func(self):
+        if self.method is None:
+            return self.propagate
+        return getattr(self.puzzle, self.method)
+
+    # Run the rule once
+    def propagate(self):
+        self.func(*self.params)
+
+    # Keys whose changes can make the rule remove more possibilities, the propagation queue reruns the rule when one changes
+    def reads(self):
+        return []
+
+    # Keys the rule can remove possibilities from
+    def writes(self):
+        return []
+
+    def entailed(self):
+        return False
+
+    # Compatibility with the (function, parameters) tuples rules used to be
+    def __getitem__(self, ind):
+        return (self.func, self.params)[ind]
+
+    def __iter__(self):
+        return iter( (self.func, self.params) )
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return "{}({})".format( type(self).__name__, self.params )
+
+    # Only keep the keys that are in the domain store (e.g. no keys from a category to itself), each key once
+    def in_store(self, keys):
+        kept = []
+        for key in keys:
+            if key in self.puzzle.store and not key in kept:
+                kept.append(key)
+        return kept
+
+    ##### Entailment Helpers ###########################################################################################################
+
+    # el_A is el_B, and no other value of cat_A is el_B
+    def linked(self, cat_A, el_A, cat_B, el_B):
+        store = self.puzzle.store
+        if not (cat_A, el_A, cat_B) in store or not el_B in store.ids[cat_B]:
+            return False
+        m = store.matrix(cat_A, cat_B)
+        i = store.ids[cat_A][el_A]
+        j = store.ids[cat_B][el_B]
+        return m[i].sum() == 1 and m[:, j].sum() == 1 and bool( m[i, j] )
+
+    def unlinked(self, cat_A, el_A, cat_B, el_B):
+        store = self.puzzle.store
+        return not (cat_A, el_A, cat_B) in store or not store.contains(cat_A, el_A, cat_B, el_B)
+
+    # Settled means a key with one value left has also been linked to it
+    def settled(self, cat_A, el_A, cat_B):
+        row = self.puzzle.store.row(cat_A, el_A, cat_B)
+        if row.sum() != 1:
+            return True
+        return self.linked( cat_A, el_A, cat_B, self.puzzle.store.values[cat_B][ row.argmax() ] )
+
+# Rule 1, el_A is el_B
+class AIsB(Propagator):
+    method = "a_is_b"
+
+    def writes(self):
+        cat_A, el_A, cat_B, el_B = self.params
+        return self.in_store( [ (cat_A, el_A, cat_B), (cat_B, el_B, cat_A) ] )
+
+    def entailed(self):
+        cat_A, el_A, cat_B, el_B = self.params
+        return not (cat_A, el_A, cat_B) in self.puzzle.store or self.linked(*self.params)
+
+# Rule 2, el_A is not el_B
+class AIsNotB(Propagator):
+    method = "a_is_not_b"
+
+    def writes(self):
+        cat_A, el_A, cat_B, el_B = self.params
+        return self.in_store( [ (cat_A, el_A, cat_B), (cat_B, el_B, cat_A) ] )
+
+    def entailed(self):
+        return self.unlinked(*self.params)
+
+# Rule 6, no two elements of the list are each other
+class MultiExclusion(Propagator):
+    method = "multi_exclusion"
+
+    def writes(self):
+        N_star = self.params[0]
+        return self.in_store( [ (cat_B, el_B, cat_C) for (cat_B, el_B), (cat_C, el_C) in itertools.permutations(N_star, 2) ] )
+
+    def entailed(self):
+        N_star = self.params[0]
+        return all( [ self.unlinked(cat_B, el_B, cat_C, el_C) for (cat_B, el_B), (cat_C, el_C) in itertools.combinations(N_star, 2) ] )
+
+# Rule 3, el_A is one of M_star
+class OneToMany(Propagator):
+    method = "one_to_many"
+
+    def reads(self):
+        cat_A, el_A, M_star = self.params
+        return self.in_store( [ (cat_A, el_A, cat_B) for cat_B, el_B in M_star ] )
+
+    def writes(self):
+        cat_A, el_A, M_star = self.params
+        return self.in_store( MultiExclusion(self.puzzle, [M_star]).writes() + self.reads() )
+
+    # Nothing is done when an element of M_star is in the same category as el_A
+    def entailed(self):
+        cat_A, el_A, M_star = self.params
+        if not all( [ (cat_A, el_A, cat_B) in self.puzzle.store for cat_B, el_B in M_star ] ):
+            return True
+        if not MultiExclusion(self.puzzle, [M_star]).entailed():
+            return False
+        return any( [ self.linked(cat_A, el_A, cat_B, el_B) for cat_B, el_B in M_star ] )
+
+# Rule 4, each element of N_star is one of M_star, and the other way around
+class ManyToMany(Propagator):
+    method = "many_to_many"
+
+    # The one to many rules it's made of, in both directions
+    def parts(self):
+        N_star, M_star = self.params
+        return [ OneToMany(self.puzzle, [cat_A, el_A, M_star]) for cat_A, el_A in N_star ] + \
+               [ OneToMany(self.puzzle, [cat_B, el_B, N_star]) for cat_B, el_B in M_star ]
+
+    def reads(self):
+        N_star, M_star = self.params
+        keys = []
+        for cat_A, el_A in N_star:
+            for cat_B, el_B in M_star:
+                keys.append( (cat_A, el_A, cat_B) )
+                keys.append( (cat_B, el_B, cat_A) )
+        return self.in_store(keys)
+
+    def writes(self):
+        keys = []
+        for part in self.parts():
+            keys.extend( [ key for key in part.writes() if not key in keys ] )
+        return keys
+
+    def entailed(self):
+        return all( [ part.entailed() for part in self.parts() ] )
+
+# Rule 5, (cat_A, el_A, cat_C) > (cat_B, el_B, cat_C), or (cat_A, el_A, cat_C) = (cat_B, el_B, cat_C) + val
+class AGreaterThanB(Propagator):
+    method = "a_greater_than_b"
+
+    def reads(self):
+        cat_A, el_A, cat_B, el_B, cat_C = self.params[:5]
+        return self.in_store( [ (cat_A, el_A, cat_C), (cat_B, el_B, cat_C) ] )
+
+    def writes(self):
+        cat_A, el_A, cat_B, el_B, cat_C = self.params[:5]
+        return self.in_store( [ (cat_A, el_A, cat_B), (cat_B, el_B, cat_A) ] + self.reads() )
+
+    # Every value left for el_A is greater (by val) than every value left for el_B, and the rows the rule settles are settled
+    def entailed(self):
+        cat_A, el_A, cat_B, el_B, cat_C = self.params[:5]
+        val = self.params[5] if len(self.params) > 5 else None
+        if not (cat_A, el_A, cat_C) in self.puzzle.store or not (cat_B, el_B, cat_C) in self.puzzle.store:
+            return False
+        if not self.unlinked(cat_A, el_A, cat_B, el_B):
+            return False
+
+        # Values are sorted by ID, so a[0] and b[-1] are the smallest and largest left
+        store = self.puzzle.store
+        a = store.numeric(cat_C)[ store.row(cat_A, el_A, cat_C) ]
+        b = store.numeric(cat_C)[ store.row(cat_B, el_B, cat_C) ]
+        if len(a) == 0 or len(b) == 0:
+            return False
+        if val is None:
+            holds = a[0] > b[-1]
+        else:
+            holds = len(a) == 1 and len(b) == 1 and a[0] == b[0] + val
+
+        keys = [ key for key in [ (cat_A, el_A, cat_B), (cat_A, el_A, cat_C), (cat_B, el_B, cat_C) ] if key in store ]
+        return holds and all( [ self.settled(*key) for key in keys ] )
@@ -0,0 +1,175 @@
+import copy
+import json
+import os
+from collections import OrderedDict
+from BatchSolver import solve_one
+from Canonical import CanonicalPuzzle
+
+# Solve results kept by a hash of the puzzle, so a puzzle seen before is answered without parsing or solving it again
+# The key is the hash of the puzzle's canonical form (see Canonical.py) and the solve options, so looking it up costs a
+# sort and a hash of the text, and puzzles that only differ in the order of their lines or values share a result.
+# Results are the dicts BatchSolver.solve_one returns (solved, contradiction, iterations, nodes, grid, error), without
+# index and time, with the grid in the canonical layout. iterations is from whichever version of the puzzle was solved first
+# Results are kept in memory up to capacity, least recently used first out, and optionally in a directory as one JSON
+# file each, up to max_bytes, also least recently used first out
+
+# Hash of a puzzle and the options it's solved with, as a hex string
+# categories and rules are lists of lines, or strings with a line each
+def puzzle_key(categories, rules, options=None):
+    return CanonicalPuzzle(categories, rules).key(options)
+
+# Whether a result is the same every time the puzzle is solved with these options
+# Searches that didn't finish may have run out of nodes or time, and timeouts are never kept
+def cacheable(result, options=None):
+    if not result.get("error") is None:
+        return not result["error"].startswith("Timeout")
+    return result["solved"] or not ( options or {} ).get("search", False)
+
+class ResultCache:
+    def __init__(self, capacity=1024, directory=None, max_bytes=64 << 20):
+        self.capacity = capacity            # most results kept in memory
+        self.directory = directory          # directory results are also written to, None to only keep them in memory
+        self.max_bytes = max_bytes          # most bytes of results kept in directory
+        self.memory = OrderedDict()         # dict from key to result, least recently used first
+        self.disk = OrderedDict()           # dict from key to size in bytes of the file in directory, least recently used first
+        self.disk_bytes = 0                 # total size of the files in directory
+        self.hits = 0
+        self.misses = 0
+
+        if not directory is None:
+            os.makedirs(directory, exist_ok=True)
+            files = []
+            for f_name in os.listdir(directory):
+                if f_name.endswith(".json"):
+                    stat = os.stat( os.path.join(directory, f_name) )
+                    files.append( ( stat.st_mtime, f_name[:-5], stat.st_size ) )
+            for mtime, key, size in sorted(files):
+                self.disk[key] = size
+                self.disk_bytes += size
+
+    def __len__(self):
+        return len( set(self.memory) | set(self.disk) )
+
+    def __contains__(self, key):
+        return key in self.memory or key in self.disk
+
+    def path(self, key):
+        return os.path.join( self.directory, key + ".json" )
+
+    # The result kept for key, or None, a result only found on disk is brought back into memory
+    # count=False leaves hits and misses to the caller, for callers that can still turn a result down
+    def get(self, key, count=True):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self.hits += count
+            return copy.deepcopy( self.memory[key] )
+
+        if key in self.disk:
+            try:
+                f = open( self.path(key), encoding="utf-8" )
+                result = json.load(f)
+                f.close()
+                os.utime( self.path(key) )
+            except (OSError, ValueError):
+                # Removed or damaged from outside, treated as a miss
+                self.disk_bytes -= self.disk.pop(key)
+                self.misses += count
+                return None
+            self.disk.move_to_end(key)
+            self.keep(key, result)
+            self.hits += count
+            return copy.deepcopy(result)
+
+        self.misses += count
+        return None
+
+    def put(self, key, result):
+        result = copy.deepcopy( { field : value for field, value in result.items() if field != "index" and field != "time" and field != "cached" } )
+        self.keep(key, result)
+        if self.directory is None:
+            return
+
+        text = json.dumps(result)
+        f = open( self.path(key), "w", encoding="utf-8" )
+        f.write(text)
+        f.close()
+        self.disk_bytes += len( text.encode("utf-8") ) - self.disk.get(key, 0)
+        self.disk[key] = len( text.encode("utf-8") )
+        self.disk.move_to_end(key)
+        while self.disk_bytes > self.max_bytes and len(self.disk) > 1:
+            old, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove( self.path(old) )
+            except OSError:
+                pass
+
+    # Keep a result in memory, dropping the least recently used one past capacity
+    def keep(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        self.memory.clear()
+        if not self.directory is None:
+            for key in self.disk:
+                try:
+                    os.remove( self.path(key) )
+                except OSError:
+                    pass
+        self.disk.clear()
+        self.disk_bytes = 0
+
+    # The cached result for a CanonicalPuzzle, with the grid in the caller's layout, or None
+    # A result whose grid can't be put in the caller's layout (see CanonicalPuzzle.translate) counts as a miss
+    def lookup(self, canonical, options=None):
+        result = self.get( canonical.key(options), count=False )
+        if not result is None and not result["grid"] is None:
+            result["grid"] = canonical.to_caller( result["grid"] )
+            if result["grid"] is None:
+                result = None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    # Keep the result of solving the caller's lines, if it's cacheable and its grid can be put in the canonical layout
+    def store(self, canonical, result, options=None):
+        if not cacheable(result, options):
+            return
+        kept = dict(result)
+        if not result["grid"] is None:
+            kept["grid"] = canonical.to_canonical( result["grid"] )
+            if kept["grid"] is None:
+                return
+        self.put( canonical.key(options), kept )
+
+    # Solve a puzzle (lists of lines or file names, as for BatchSolver.load_puzzle) unless its result is already kept
+    # The result has cached set to whether it came from the cache
+    def solve(self, categories, rules, **options):
+        if isinstance(categories, str):
+            categories = read_lines(categories)
+        if isinstance(rules, str):
+            rules = read_lines(rules)
+
+        canonical = CanonicalPuzzle(categories, rules)
+        result = self.lookup(canonical, options)
+        if result is None:
+            result = solve_one(0, categories, rules, options)
+            self.store(canonical, result, options)
+            result = { field : value for field, value in result.items() if field != "index" }
+            result["cached"] = False
+        else:
+            result["cached"] = True
+        return result
+
+def read_lines(f_name):
+    f = open(f_name)
+    lines = f.readlines()
+    f.close()
+    return lines
@@ -1,7 +1,9 @@
 #from LogicPuzzle import LogicPuzzle
 from Token import Token, TokenType
+import os
 
-GRAMMAR_FILE = "Grammar.txt"
+# The grammar next to this file, so it's found from any working directory
+GRAMMAR_FILE = os.path.join( os.path.dirname( os.path.abspath(__file__) ), "Grammar.txt" )
 
 class InvalidTokenException(Exception):
     pass
@@ -17,35 +19,54 @@ class GrammarNode:
         self.next = {}
         self.value = -1
 
-class RuleParser:
-    def __init__(self):
-        self.grammar = GrammarNode()
-        self.read_grammar()
-
-    def read_grammar(self):
-        f = open(GRAMMAR_FILE)
-        for line in f:
-            if '%' in line:
-                line = line[ :line.index('%') ]
-            line = line.strip()
-            if line.strip() == '':
-                continue
-            
-            parts = line.split(":")
-            tokens = parts[1].split(",")
-            current_node = self.grammar
-            for i in range(len(tokens)):
-                el = tokens[i]
-                tok_type = TokenType.get_type(el)
-                if not tok_type == TokenType.INVALID and not tok_type in current_node.next:
-                    # If the current noded doesn't have anything in the path you're following, add it
-                    current_node.next[tok_type] = GrammarNode()
-                # Advance a node
-                current_node = current_node.next[tok_type]
-                if i == len(tokens) - 1:
-                    # Ending here makes this the rule given at the beginning of the line
-                    current_node.value = float( parts[0] )
+# Build the grammar trie from the lines of a grammar file
+def compile_grammar(lines):
+    grammar = GrammarNode()
+    for line in lines:
+        if '%' in line:
+            line = line[ :line.index('%') ]
+        line = line.strip()
+        if line.strip() == '':
+            continue
+        
+        parts = line.split(":")
+        tokens = parts[1].split(",")
+        current_node = grammar
+        for i in range(len(tokens)):
+            el = tokens[i]
+            tok_type = TokenType.get_type(el)
+            if not tok_type == TokenType.INVALID and not tok_type in current_node.next:
+                # If the current noded doesn't have anything in the path you're following, add it
+                current_node.next[tok_type] = GrammarNode()
+            # Advance a node
+            current_node = current_node.next[tok_type]
+            if i == len(tokens) - 1:
+                # Ending here makes this the rule given at the beginning of the line
+                current_node.value = float( parts[0] )
+    return grammar
+
+compiled_grammars = {}                      # dict from absolute grammar file path to its grammar trie, shared by every RuleParser
+
+# Grammar trie for a grammar file, only read and built the first time it's asked for in the process
+# The trie is shared, so it must not be changed after it's built
+def load_grammar(grammar_f_name=GRAMMAR_FILE):
+    path = os.path.abspath(grammar_f_name)
+    if not path in compiled_grammars:
+        f = open(path)
+        compiled_grammars[path] = compile_grammar(f)
         f.close()
+    return compiled_grammars[path]
+
+class RuleParser:
+    # grammar_f_name can be given to use a custom grammar file instead of Grammar.txt
+    def __init__(self, grammar_f_name=None):
+        self.grammar = None
+        self.read_grammar(grammar_f_name)
+
+    def read_grammar(self, grammar_f_name=None):
+        if grammar_f_name is None:
+            grammar_f_name = GRAMMAR_FILE
+        self.grammar = load_grammar(grammar_f_name)
 
     # Simply read the lines form the rule file
     # Tokenize and parse later
@@ -53,26 +74,41 @@ class RuleParser:
         if f_name is None:
             return
 
-        lines = []
         f = open(f_name)
+        lines = self.split_rules(f)
+        f.close()
+        return lines
 
-        for line in f:
+    # Split lines of rule text into the strings that will become tokens
+    def split_rules(self, text_lines):
+        lines = []
+        for line in text_lines:
             if '#' in line:
                 # Strip any comments out
                 ind = line.index('#')
                 line = line[:ind]
             lines.append( line.split() )
-
-        f.close()
         return lines
 
+    # Values in more than one category can't be used on their own, they have to be written as category:value
     def tokenize(self, lines, puzzle):
         tokenized_lines = []
-        for line in lines:
-            tokenized_lines.append( [ Token(el, puzzle) for el in line ] )
+        for i in range(len(lines)):
+            line = [ Token(el, puzzle) for el in lines[i] ]
+            for j in range(len(line)):
+                if not line[j].valid:
+                    self.check_ambiguous(i, j, line[j].value, puzzle)
+            tokenized_lines.append( line )
         
         return tokenized_lines
 
+    # Raise an InvalidTokenException naming the categories if token (or a member of a list/pair token) is an ambiguous value
+    def check_ambiguous(self, i, j, token, puzzle):
+        for el in token.strip("[]").replace(",", " ").split():
+            if el in puzzle.ambiguous_values:
+                raise InvalidTokenException( "Expression {}: Ambiguous token. Token {} - value = {} is in categories {}, write it as category:value".format(
+                    i+1, j+1, el, ", ".join(puzzle.ambiguous_values[el]) ) )
+
     def validate(self, lines):
         verified = []
 
@@ -85,8 +121,11 @@ class RuleParser:
                         raise InvalidTokenException( "Expression {}: Invalid token. Token {} - value = {}".format(i+1, j+1, str(line[j].value) ) )
         
         # Verify that the tokens satisfy the grammar
+        # Blank lines (and lines that were only a comment) are skipped
         for i in range(len(lines)):
             line = lines[i]
+            if len(line) == 0:
+                continue
             current = self.grammar
             last = None
             for j in range(len(line)):
@@ -105,4 +144,9 @@ class RuleParser:
     def get_validated_rules(self, rule_f_name, puzzle):
         lines = self.read_rules( rule_f_name )
         tokenized = self.tokenize( lines, puzzle )
+        return self.validate( tokenized )
+
+    # Same as get_validated_rules, for rules that aren't in a file
+    def get_validated_rule_lines(self, text_lines, puzzle):
+        tokenized = self.tokenize( self.split_rules(text_lines), puzzle )
         return self.validate( tokenized )
\ No newline at end of file
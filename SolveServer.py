@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from BatchSolver import solve_one, new_result
+from ResultCache import ResultCache
+from Canonical import CanonicalPuzzle
+
+# Headless solve service, JSON over HTTP on an asyncio server
+# Puzzles are solved in a pool of worker processes, so many requests can be answered at once without blocking the event loop,
+# and nothing is written to disk
+#
+#   POST /solve     body is a JSON object:
+#                       categories  -> list of category lines, or one string with a line per category
+#                       rules       -> list of rule lines, or one string with a line per rule
+#                       options     -> optional dict passed on to LogicPuzzle.solve (search, node_limit, time_limit, worklist)
+#                       timeout     -> optional seconds to wait for the solve, at most the server's timeout
+#                   answer is the BatchSolver result dict (solved, contradiction, iterations, nodes, grid, error, time)
+#                   with a status: solved, unsolved, contradiction, error (422) or timeout (504), and cached, whether
+#                   the answer came from the result cache without solving. If the solve couldn't be run at all the
+#                   status is error too, with 503 if a worker process died (the pool is started again) or 500 otherwise
+#   GET /health     answer is {"status" : "ok"}
+#
+# Requests that aren't valid JSON or are missing categories or rules get a 400 with an error message
+
+OPTIONS = ["search", "node_limit", "time_limit", "worklist", "intermediate_logic"]
+REASONS = { 200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 413 : "Payload Too Large",
+            422 : "Unprocessable Entity", 500 : "Internal Server Error", 503 : "Service Unavailable", 504 : "Gateway Timeout" }
+
+class BadRequest(Exception):
+    def __init__(self, message, code=400):
+        super().__init__(message)
+        self.code = code
+
+# Lines of a categories or rules field, a string is split into lines
+# Strings are never taken as file names, so clients can't read files from the server
+def request_lines(request, field):
+    lines = request.get(field)
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    if not isinstance(lines, list) or not all( [ isinstance(line, str) for line in lines ] ):
+        raise BadRequest( "{} must be a list of lines or a string".format(field) )
+    return [ line for line in lines if line.strip() != "" ]
+
+def result_status(result):
+    if not result["error"] is None:
+        return "timeout" if result["error"].startswith("Timeout") else "error"
+    if result["contradiction"]:
+        return "contradiction"
+    return "solved" if result["solved"] else "unsolved"
+
+class SolveServer:
+    def __init__(self, host="127.0.0.1", port=8080, workers=None, timeout=10.0, max_body=1 << 20, cache_size=1024, cache_dir=None):
+        self.host = host
+        self.port = port                    # 0 picks a free port, the one picked is set once the server starts
+        self.workers = workers              # worker processes, None for one per CPU
+        self.timeout = timeout              # most seconds a request waits for its solve
+        self.max_body = max_body            # largest request body accepted, in bytes
+        self.executor = None
+        self.server = None
+        self.requests = 0                   # number of solve requests answered
+        self.cache = None                   # ResultCache of the answers, None when cache_size is 0
+        if cache_size > 0:
+            self.cache = ResultCache(cache_size, cache_dir)
+
+    # Workers are spawned rather than forked, a forked worker would hold on to the sockets of the connections open at the time
+    def start_executor(self):
+        self.executor = ProcessPoolExecutor( max_workers=self.workers, mp_context=multiprocessing.get_context("spawn") )
+
+    # A pool whose worker died can't take any more work, so it's replaced by a new one
+    def restart_executor(self, broken):
+        if self.executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.start_executor()
+
+    async def start(self):
+        self.start_executor()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if not self.server is None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if not self.executor is None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # Solve a request dict, returns (HTTP status code, answer dict)
+    # A solve that times out keeps its worker until it finishes, so when searching, solve's own time_limit is capped
+    # at the timeout too
+    async def solve(self, request):
+        if not isinstance(request, dict):
+            raise BadRequest("Request must be a JSON object")
+        categories = request_lines(request, "categories")
+        rules = request_lines(request, "rules")
+        options = request.get("options", {})
+        if not isinstance(options, dict) or any( [ not option in OPTIONS for option in options ] ):
+            raise BadRequest( "options can only be {}".format( ", ".join(OPTIONS) ) )
+        timeout = request.get("timeout", self.timeout)
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise BadRequest("timeout must be a positive number of seconds")
+        timeout = min(timeout, self.timeout)
+
+        canonical = None
+        if not self.cache is None:
+            canonical = CanonicalPuzzle(categories, rules)
+            result = self.cache.lookup(canonical, options)
+            if not result is None:
+                self.requests += 1
+                result["time"] = 0.0
+                result["status"] = result_status(result)
+                result["cached"] = True
+                return { "error" : 422 }.get( result["status"], 200 ), result
+
+        solve_options = dict(options)
+        solve_options["time_limit"] = min( options.get("time_limit") or timeout, timeout )
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        code = None                         # set when the solve couldn't be run, the result is then never cached
+        try:
+            result = await asyncio.wait_for( loop.run_in_executor( executor, solve_one, 0, categories, rules, solve_options ), timeout )
+        except asyncio.TimeoutError:
+            result = new_result( 0, "Timeout: no answer after {} seconds".format(timeout) )
+        except BrokenProcessPool as e:
+            self.restart_executor(executor)
+            result = new_result( 0, "{}: {}".format( type(e).__name__, str(e) ) )
+            code = 503
+        except Exception as e:
+            result = new_result( 0, "{}: {}".format( type(e).__name__, str(e) ) )
+            code = 500
+        if result["time"] == 0.0:
+            # Made here rather than by solve_one, so not timed yet
+            result["time"] = time.perf_counter() - start
+        self.requests += 1
+        if not canonical is None and code is None:
+            self.cache.store(canonical, result, options)
+
+        del result["index"]
+        result["status"] = result_status(result)
+        result["cached"] = False
+        if code is None:
+            code = { "error" : 422, "timeout" : 504 }.get( result["status"], 200 )
+        return code, result
+
+    # Answer one HTTP request on a connection, then close it
+    async def handle(self, reader, writer):
+        try:
+            code, answer = await self.respond(reader)
+        except BadRequest as e:
+            code, answer = e.code, { "status" : "error", "error" : str(e) }
+        except asyncio.LimitOverrunError:
+            code, answer = 400, { "status" : "error", "error" : "Request line or header is too long" }
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        body = json.dumps(answer).encode("utf-8")
+        head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            code, REASONS[code], len(body) )
+        try:
+            writer.write( head.encode("latin-1") + body )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        try:
+            method, path, version = ( await reader.readuntil(b"\r\n") ).decode("latin-1").split()
+        except ValueError:
+            raise BadRequest("Malformed request line")
+
+        headers = {}
+        while True:
+            line = ( await reader.readuntil(b"\r\n") ).decode("latin-1").strip()
+            if line == "":
+                break
+            name, _, value = line.partition(":")
+            headers[ name.strip().lower() ] = value.strip()
+
+        path = path.split("?")[0]
+        if path == "/health":
+            if method != "GET":
+                raise BadRequest("Use GET for /health", 405)
+            return 200, { "status" : "ok", "requests" : self.requests }
+        if path != "/solve":
+            raise BadRequest( "Unknown path {}".format(path), 404 )
+        if method != "POST":
+            raise BadRequest("Use POST for /solve", 405)
+
+        try:
+            length = int( headers.get("content-length", "") )
+        except ValueError:
+            raise BadRequest("Content-Length is required")
+        if length > self.max_body:
+            raise BadRequest( "Body is larger than {} bytes".format(self.max_body), 413 )
+        try:
+            request = json.loads( ( await reader.readexactly(length) ).decode("utf-8") )
+        except ValueError as e:
+            raise BadRequest( "Body isn't valid JSON: {}".format( str(e) ) )
+        return await self.solve(request)
+
+# Run a server until interrupted
+def serve(host="127.0.0.1", port=8080, workers=None, timeout=10.0, cache_size=1024, cache_dir=None):
+    server = SolveServer(host, port, workers, timeout, cache_size=cache_size, cache_dir=cache_dir)
+    try:
+        asyncio.run( server.serve_forever() )
+    except KeyboardInterrupt:
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser( description="Solve puzzles sent as JSON over HTTP" )
+    parser.add_argument( "--host", default="127.0.0.1", help="address to listen on" )
+    parser.add_argument( "--port", type=int, default=8080, help="port to listen on" )
+    parser.add_argument( "--workers", type=int, default=None, help="worker processes (default one per CPU)" )
+    parser.add_argument( "--timeout", type=float, default=10.0, help="most seconds spent on a request" )
+    parser.add_argument( "--cache-size", type=int, default=1024, help="answers kept in memory (0 for no cache)" )
+    parser.add_argument( "--cache-dir", default=None, help="directory answers are also kept in" )
+    args = parser.parse_args(argv)
+
+    print( "Serving on http://{}:{}".format(args.host, args.port) )
+    serve( args.host, args.port, args.workers, args.timeout, args.cache_size, args.cache_dir )
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
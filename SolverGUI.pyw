@@ -1,8 +1,9 @@
 import sys
-import os
-from LogicPuzzle import LogicPuzzle
+import threading
+from LogicPuzzle import LogicPuzzle, SolveCancelled
 from RuleParser import InvalidTokenException, UnexpectedTokenException, MissingTokenException
 
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow
 )
@@ -10,56 +11,113 @@ from PyQt5.uic import loadUi
 
 from GUI.Solver import Ui_MainWindow
 
+# Reads and solves a puzzle on its own thread, so the window stays responsive
+# Everything it finds out is sent back to the window through signals
+class SolveWorker(QObject):
+    progress = pyqtSignal(int, int)         # rounds so far, possibilities left
+    solved = pyqtSignal(object)             # (puzzle, solved, loops, grid)
+    failed = pyqtSignal(str)                # message to show
+    cancelled = pyqtSignal()
+    done = pyqtSignal()                     # sent last, whatever happened
+
+    def __init__(self, categories, rules, cancel):
+        super().__init__()
+        self.categories = categories        # text of the categories box
+        self.rules = rules                  # text of the rules box
+        self.cancel = cancel                # threading.Event set by the window to stop the solve
+
+    def run(self):
+        try:
+            puzzle = LogicPuzzle.from_text(self.categories, self.rules)
+            solved, loops, grid = puzzle.solve(True, False, True, progress=self.progress.emit, cancel=self.cancel)
+            self.solved.emit( (puzzle, solved, loops, grid) )
+        except SolveCancelled:
+            self.cancelled.emit()
+        except InvalidTokenException as e:
+            self.failed.emit( "Invalid Token\n{}".format( str(e) ) )
+        except UnexpectedTokenException as e:
+            self.failed.emit( "Unexpected Token\n{}".format( str(e) ) )
+        except MissingTokenException as e:
+            self.failed.emit( "Missing Token\n{}".format( str(e) ) )
+        except Exception as e:
+            self.failed.emit( "Unexpected Error\n{}".format( str(e) ) )
+        finally:
+            self.done.emit()
+
 class Window(Ui_MainWindow, QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setupUi(self)
         loadUi("GUI/Solver.ui", self)
+        self.solve_thread = None            # QThread the current solve runs on, None when nothing is being solved
+        self.worker = None
+        self.cancel = None                  # threading.Event that cancels the current solve
         self.connectSignalsSlots()
 
     def connectSignalsSlots(self):
         self.solve_button.clicked.connect(self.solve)
         self.clear_button.clicked.connect(self.clear)
         self.reset_button.clicked.connect(self.reset)
+        self.cancel_button.clicked.connect(self.cancel_solve)
     
+    # Start solving on a worker thread, the categories and rules are read straight from the text boxes
     def solve(self):
-        cat_f_name = os.path.join("GUI","categories.txt")
-        rule_f_name = os.path.join("GUI","rules.txt")
-        with open( cat_f_name, 'w' ) as f:
-            f.write( self.category_text.toPlainText() )
-        with open( rule_f_name, 'w' ) as f:
-            f.write( self.rule_text.toPlainText() )
+        if not self.solve_thread is None:
+            return
 
-        # TODO : Put this in a try and output error results
+        self.cancel = threading.Event()
+        self.solve_thread = QThread()
+        self.worker = SolveWorker( self.category_text.toPlainText(), self.rule_text.toPlainText(), self.cancel )
+        self.worker.moveToThread(self.solve_thread)
+        self.solve_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.solved.connect(self.show_result)
+        self.worker.failed.connect(self.output_text.setPlainText)
+        self.worker.cancelled.connect(self.show_cancelled)
+        self.worker.done.connect(self.solve_done)
 
-        try:
-            puzzle = LogicPuzzle(cat_f_name, rule_f_name)
-            os.remove(cat_f_name)
-            os.remove(rule_f_name)
-            solved, loops, grid = puzzle.solve(True, False, True)
-
-            self.result_text.setText( grid.get_string() )
-            msg = "Ran {} loops\n".format(loops)
-            if solved:
-                msg += "Solved!"
-            else:
-                msg += "Could not fully solve..."
-            
-            if puzzle.contains_empty_sets():
-                msg += "\nEmpty sets in puzzle. Double-check rules"
-
-            self.output_text.setPlainText(msg)
-        except InvalidTokenException as e:
-            self.output_text.setPlainText( "Invalid Token\n{}".format( str(e) ) )
-        except UnexpectedTokenException as e:
-            self.output_text.setPlainText( "Unexpected Token\n{}".format( str(e) ) )
-        except MissingTokenException as e:
-            self.output_text.setPlainText( "Missing Token\n{}".format( str(e) ) )
-        except Exception as e:
-            self.output_text.setPlainText( "Unexpected Error\n{}".format( str(e) ) )
+        self.output_text.setPlainText("Solving...")
+        self.solve_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.solve_thread.start()
+
+    # The solve stops before its next rule or logic pass
+    def cancel_solve(self):
+        if not self.cancel is None:
+            self.cancel.set()
+            self.cancel_button.setEnabled(False)
+            self.output_text.appendPlainText("Cancelling...")
+
+    def show_progress(self, rounds, remaining):
+        self.output_text.appendPlainText( "Loop {}: {} possibilities left".format(rounds, remaining) )
+
+    def show_result(self, result):
+        puzzle, solved, loops, grid = result
+        self.result_text.setText( grid.get_string() )
+        msg = "Ran {} loops\n".format(loops)
+        if solved:
+            msg += "Solved!"
+        else:
+            msg += "Could not fully solve..."
         
+        if puzzle.contains_empty_sets():
+            msg += "\nEmpty sets in puzzle. Double-check rules"
+
+        self.output_text.setPlainText(msg)
         self.write(puzzle)
-        
+
+    def show_cancelled(self):
+        self.output_text.appendPlainText("Cancelled")
+
+    def solve_done(self):
+        self.solve_thread.quit()
+        self.solve_thread.wait()
+        self.solve_thread = None
+        self.worker = None
+        self.cancel = None
+        self.solve_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
     def clear(self):
         self.output_text.setPlainText("")
 
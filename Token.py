@@ -69,21 +69,12 @@ class Token():
     
     # Element is defined as a (category,value) tuple for a value in a category of the logic puzzle
     # Given a value (the token), check to make sure it's in the puzzled and return the category and value
+    # Because there is a numerical token type, categories with numerical values will be written as category_name:number
+    # The lookup goes through the puzzle's element index, so it doesn't depend on the number of categories
     def get_element(self, puzzle, value=None):
         if value is None:
             value = self.value
-
-        # Because there is a numerical token type, categories with numerical values will be written as category_name:number
-        if ":" in value:
-            cat_A, el_A = value.split(":")
-            if cat_A in puzzle.categories and Token.is_numerical(el_A) and float(el_A) in puzzle.category_values[cat_A]:
-                return (cat_A, float(el_A))
-            return None
-
-        for category in puzzle.category_values:
-            if value in puzzle.category_values[category]:
-                return (category, value)
-        return None
+        return puzzle.find_element(value)
 
     # Given an token that doesn't fit in any otehr category, check to see if it's a valid element
     def validate_element_token(self, puzzle):
@@ -0,0 +1,138 @@
+import numpy as np
+
+# Kinds of change made to the domain store
+INTERSECTION = 0                            # a set was intersected with other values (restrict, intersect, ...)
+A_IS_B = 1                                  # a_is_b linked two values
+A_IS_NOT_B = 2                              # a_is_not_b removed one value
+ROLLBACK = 3                                # the store was rolled back, row holds the number of cells that were undone
+KIND_NAMES = ["intersection", "a_is_b", "a_is_not_b", "rollback"]
+
+# What was running when a change was made
+OTHER = 0                                   # called directly, outside of solve
+RULE = 1                                    # a rule, cause is its index in puzzle.rules
+PASS = 2                                    # a logic pass, cause is its index in PASS_NAMES
+SEARCH = 3                                  # a guess made by search
+SOURCE_NAMES = ["other", "rule", "pass", "search"]
+PASS_NAMES = ["link_inclusion", "link_exclusion", "n_of_n", "difference_bounds"]
+
+# Records every change to a DomainStore (almost always a possibility removed), with what made it and in which sweep (or worklist round)
+# Events go into preallocated arrays used as a ring buffer, so recording is a few array writes per change and the
+# memory used doesn't grow, once full the oldest events are overwritten
+# Each event is one cell of a stored matrix, i.e. el_B removed from (cat_A, el_A, cat_B) and el_A from (cat_B, el_B, cat_A)
+class TraceRecorder:
+    def __init__(self, store, capacity=65536):
+        self.store = store
+        self.capacity = capacity
+        self.pairs = list( store.matrices )     # stored pairs, an event's pair is an index into this list
+        self.pair_ids = { pair : i for i, pair in enumerate(self.pairs) }
+        self.count = 0                      # events recorded so far, including the ones overwritten
+        self.sweep = 0                      # sweep (or worklist round) the next events belong to
+        self.source = OTHER                 # what's making the next changes, one of the source constants
+        self.cause = -1                     # rule index or pass index for the next changes
+
+        self.sweeps = np.zeros(capacity, dtype=np.int32)
+        self.kinds = np.zeros(capacity, dtype=np.int8)
+        self.sources = np.zeros(capacity, dtype=np.int8)
+        self.causes = np.zeros(capacity, dtype=np.int32)
+        self.pair_index = np.zeros(capacity, dtype=np.int16)
+        self.rows = np.zeros(capacity, dtype=np.int32)
+        self.cols = np.zeros(capacity, dtype=np.int32)
+
+    # Called by the store for every change, rows and cols are the flipped cells of the stored (cat_A, cat_B) matrix
+    def record(self, pair, kind, rows, cols):
+        n = len(rows)
+        if n > self.capacity:
+            rows = rows[-self.capacity:]
+            cols = cols[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+
+        slots = ( self.count + np.arange(n) ) % self.capacity
+        self.sweeps[slots] = self.sweep
+        self.kinds[slots] = kind
+        self.sources[slots] = self.source
+        self.causes[slots] = self.cause
+        self.pair_index[slots] = -1 if pair is None else self.pair_ids[pair]
+        self.rows[slots] = rows
+        self.cols[slots] = cols
+        self.count += n
+
+    def record_rollback(self, cells):
+        self.record( None, ROLLBACK, [cells], [-1] )
+
+    def set_cause(self, source, cause=-1):
+        self.source = source
+        self.cause = cause
+
+    def next_sweep(self):
+        self.sweep += 1
+
+    # Events lost because the buffer filled up
+    def dropped(self):
+        return max( 0, self.count - self.capacity )
+
+    # Slots of the events still in the buffer, oldest first
+    def slots(self):
+        if self.count <= self.capacity:
+            return np.arange(self.count)
+        return ( self.count + np.arange(self.capacity) ) % self.capacity
+
+    # The events still in the buffer, oldest first, as one array per field (cheap to compare between runs)
+    def arrays(self):
+        slots = self.slots()
+        return { "sweep" : self.sweeps[slots], "kind" : self.kinds[slots], "source" : self.sources[slots], "cause" : self.causes[slots],
+                 "pair" : self.pair_index[slots], "row" : self.rows[slots], "col" : self.cols[slots] }
+
+    # The events still in the buffer, oldest first, as readable tuples
+    # (sweep, kind, source, cause, cat_A, el_A, cat_B, el_B), cause being a rule index or pass name, or None
+    # Rollbacks are (sweep, "rollback", source, cause, None, number of cells undone, None, None)
+    def events(self):
+        values = self.store.values
+        events = []
+        for slot in self.slots():
+            kind = int( self.kinds[slot] )
+            source = int( self.sources[slot] )
+            cause = int( self.causes[slot] )
+            if source == PASS:
+                cause = PASS_NAMES[cause]
+            elif source != RULE:
+                cause = None
+
+            if kind == ROLLBACK:
+                events.append( ( int( self.sweeps[slot] ), KIND_NAMES[kind], SOURCE_NAMES[source], cause, None, int( self.rows[slot] ), None, None ) )
+                continue
+            cat_A, cat_B = self.pairs[ self.pair_index[slot] ]
+            events.append( ( int( self.sweeps[slot] ), KIND_NAMES[kind], SOURCE_NAMES[source], cause,
+                             cat_A, values[cat_A][ self.rows[slot] ], cat_B, values[cat_B][ self.cols[slot] ] ) )
+        return events
+
+    # Apply the recorded changes to another store with the same categories, e.g. to step through a solve again
+    # Only possible if no events were dropped
+    def replay(self, store, stop=None):
+        if self.dropped() > 0:
+            raise ValueError( "{} events were dropped, the trace can't be replayed".format( self.dropped() ) )
+        trace = self.arrays()
+        stop = len( trace["kind"] ) if stop is None else stop
+        for i in range(stop):
+            if trace["kind"][i] == ROLLBACK:
+                # Each replayed cell is its own entry on the trail
+                store.rollback( len(store.trail) - int( trace["row"][i] ) )
+                continue
+            pair = self.pairs[ trace["pair"][i] ]
+            store.matrices[pair][ trace["row"][i], trace["col"][i] ] ^= True
+            store.trail.append( ( pair, trace["row"][i:i+1], trace["col"][i:i+1] ) )
+
+# Index of the first event where two traces differ, or None if they're the same
+# Traces from different versions of the solver can be compared this way to find where their deductions diverge
+def diff_traces(trace_a, trace_b):
+    a = trace_a.arrays()
+    b = trace_b.arrays()
+    n = min( len( a["kind"] ), len( b["kind"] ) )
+    same = np.ones(n, dtype=bool)
+    for field in ["kind", "pair", "row", "col"]:
+        same &= a[field][:n] == b[field][:n]
+    if not same.all():
+        return int( np.argmin(same) )
+    if len( a["kind"] ) != len( b["kind"] ):
+        return n
+    return None
@@ -1,8 +1,65 @@
 import unittest
-from LogicPuzzle import LogicPuzzle
-from RuleParser import RuleParser, InvalidTokenException, UnexpectedTokenException, MissingTokenException
+from LogicPuzzle import LogicPuzzle, SolveCancelled
+from RuleParser import RuleParser, InvalidTokenException, UnexpectedTokenException, MissingTokenException, load_grammar
 from Token import Token, TokenType
+from DomainStore import DomainStore
+from AllDifferent import max_matching, all_different
+from DifferenceNetwork import DifferenceNetwork
+from BatchSolver import solve_many, load_puzzle
+from Generator import PuzzleGenerator, UniquePuzzleGenerator, generate_puzzles, generate_unique_puzzles
+from Benchmark import run_benchmark, parse_sizes
+from SolveServer import SolveServer
+from ResultCache import ResultCache, puzzle_key
+from Canonical import CanonicalPuzzle, first_duplicates
+from Profiler import report_table
+from TraceRecorder import diff_traces
+from Corpus import read_corpus, write_corpus, corpus_puzzles, records_from_games, record_from_files, puzzle_from_record, matches_solution
+from Propagator import Propagator, AIsB, AIsNotB, OneToMany, ManyToMany, AGreaterThanB
+import numpy as np
+import itertools
+import random
+import tempfile
 import os
+import json
+import asyncio
+import threading
+
+# Straightforward set versions of the link logic, to check the matrix versions against
+# Removing el_C from (cat_A, el_A, cat_C) also removes el_A from (cat_C, el_C, cat_A), like the domain store
+def reference_remove(full_sets, cat_A, el_A, cat_C, els):
+    for el_C in full_sets[(cat_A, el_A, cat_C)] & els:
+        full_sets[(cat_A, el_A, cat_C)].remove(el_C)
+        full_sets[(cat_C, el_C, cat_A)].remove(el_A)
+
+def reference_link_inclusion(lp, full_sets):
+    for cat_A, cat_B, cat_C in itertools.permutations(lp.categories,3):
+        for el_A in lp.category_values[cat_A]:
+            seed = set()
+            for el_B in full_sets[(cat_A, el_A, cat_B)]:
+                seed |= full_sets[(cat_B, el_B, cat_C)]
+            reference_remove(full_sets, cat_A, el_A, cat_C, lp.category_values[cat_C] - seed)
+
+def reference_link_exclusion(lp, full_sets):
+    for cat_A, cat_B, cat_C in itertools.permutations(lp.categories,3):
+        for el_A in lp.category_values[cat_A]:
+            for el_B in (lp.category_values[cat_B] - full_sets[(cat_A, el_A, cat_B)]):
+                c_set = full_sets[(cat_B, el_B, cat_C)]
+                if len(c_set) == 1:
+                    reference_remove(full_sets, cat_A, el_A, cat_C, set(c_set))
+
+# A 4x5 puzzle with a random subset of possibilities removed
+def random_puzzle(seed):
+    rng = random.Random(seed)
+    lp = LogicPuzzle()
+    lp.set_categories( [ "W : w1, w2, w3, w4, w5", "X : x1, x2, x3, x4, x5", "Y : y1, y2, y3, y4, y5", "Z : 1, 2, 3, 4, 5" ] )
+    lp.create_sets()
+    # Both directions share the same data, so earlier restrictions can already have emptied a set
+    for key in list(lp.full_sets):
+        els = sorted( lp.full_sets[key] )
+        if els:
+            keep = rng.randint(1, len(els))
+            lp.full_sets[key] = set( rng.sample(els, keep) )
+    return lp
 
 # Test methods in LogicPuzzle
 class LogicPuzzleTest(unittest.TestCase):
@@ -57,6 +114,99 @@ class LogicPuzzleTest(unittest.TestCase):
         assert( lp.rules[5][0] == lp.a_greater_than_b )
         assert( lp.rules[5][1] == ["A","a2","B","b3","C",2] )
 
+    def test_from_text(self):
+        cat_f_name = os.path.join("Games", "game3", "categories.txt")
+        rule_f_name = os.path.join("Games", "game3", "rules.txt")
+        from_files = LogicPuzzle(cat_f_name, rule_f_name)
+        f = open(cat_f_name)
+        categories = f.read()
+        f.close()
+        f = open(rule_f_name)
+        rules = f.read()
+        f.close()
+
+        # Straight from strings or lines, blank lines and comments are fine
+        lp = LogicPuzzle.from_text( categories + "\n\n", "# Game 3\n" + rules )
+        assert( lp.categories == from_files.categories )
+        assert( [ repr(rule) for rule in lp.rules ] == [ repr(rule) for rule in from_files.rules ] )
+        assert( lp.clone_sets() == from_files.clone_sets() )
+        lp.solve(show=False)
+        from_files.solve(show=False)
+        assert( lp.is_complete() )
+        assert( lp.get_grid().tolist() == from_files.get_grid().tolist() )
+
+        lp = LogicPuzzle.from_lines( iter( categories.splitlines() ), ( line for line in rules.splitlines() ) )
+        assert( len(lp.rules) == len(from_files.rules) )
+
+        # Categories only, rules can be added later
+        lp = LogicPuzzle.from_text("A : a1, a2\nB : b1, b2")
+        assert( lp.rules == [] )
+        lp.set_rule_lines( ["a1 = b2"] )
+        lp.solve(show=False)
+        assert( lp.full_sets[("A","a2","B")] == set(["b1"]) )
+
+        with self.assertRaises(InvalidTokenException):
+            LogicPuzzle.from_text("A : a1, a2\nB : b1, b2", "a1 = b3")
+
+    def test_add_remove_rule(self):
+        f = open( os.path.join("Games", "game3", "categories.txt") )
+        categories = f.read()
+        f.close()
+        f = open( os.path.join("Games", "game3", "rules.txt") )
+        rules = [ line for line in f.read().splitlines() if line.strip() != "" ]
+        f.close()
+
+        # State of propagating lines from scratch
+        def propagated(lines):
+            lp = LogicPuzzle.from_text( categories, "\n".join(lines) )
+            lp.propagate()
+            return lp.clone_sets()
+
+        # Rules added one at a time reach the same state as all of them at once
+        lp = LogicPuzzle.from_text( categories, "\n".join( rules[:4] ) )
+        lp.propagate()
+        for line in rules[4:]:
+            assert( lp.add_rule(line) == len(lp.rules) - 1 )
+        assert( len(lp.rules) == len(rules) )
+        assert( lp.is_complete() )
+        assert( lp.clone_sets() == propagated(rules) )
+
+        # Removing an added rule only undoes it, the rules added after it still hold
+        lp.remove_rule(5)
+        assert( len(lp.rules) == len(rules) - 1 )
+        assert( lp.clone_sets() == propagated( rules[:5] + rules[6:] ) )
+
+        # Same for one of the rules the puzzle started with
+        lp.remove_rule(1)
+        remaining = rules[:1] + rules[2:5] + rules[6:]
+        assert( lp.clone_sets() == propagated(remaining) )
+
+        # The new indices still work, and a rule can be added back
+        lp.remove_rule( len(lp.rules) - 1 )
+        lp.add_rule( rules[-1] )
+        assert( lp.clone_sets() == propagated(remaining) )
+
+        with self.assertRaises(ValueError):
+            lp.add_rule("")
+        with self.assertRaises(IndexError):
+            lp.remove_rule( len(lp.rules) )
+
+    def test_element_index(self):
+        lp = LogicPuzzle()
+        lp.set_categories( [ "A : a1, a2, x", "B : b1, x, y", "C : 1, 2, 3", "D : y, d2, d3" ] )
+
+        assert( lp.element_index["a1"] == ("A","a1") )
+        assert( lp.element_index["A:a1"] == ("A","a1") )
+        assert( lp.element_index["C:1"] == ("C",1.0) )
+        assert( not "1" in lp.element_index )
+
+        # Values in more than one category are found when the categories are read, and only indexed as category:value
+        assert( lp.ambiguous_values == { "x" : ["A","B"], "y" : ["B","D"] } )
+        assert( not "x" in lp.element_index )
+        assert( lp.find_element("x") is None )
+        assert( lp.find_element("B:x") == ("B","x") )
+        assert( lp.find_element("D:y") == ("D","y") )
+
     def test_set_rules(self):
         lp = LogicPuzzle()
         lp.read_categories( os.path.join("tests", "categories1.txt") )
@@ -157,7 +307,33 @@ class LogicPuzzleTest(unittest.TestCase):
         b_sub, a_sub = lp.subset(b,a,val=2)
         assert( b_sub == b )
         assert( a_sub == a )
-    
+
+    def test_subset_rows(self):
+        lp = LogicPuzzle()
+        years = [ str(1950 + 2*i) for i in range(60) ]
+        lp.set_categories( [ "A : " + ", ".join( [ "a{}".format(i) for i in range(60) ] ), "Year : " + ", ".join(years) ] )
+        lp.create_sets()
+        values = lp.store.numeric("Year")
+
+        # The bounds and shift tables have to agree with subset on sets of values
+        rng = random.Random(0)
+        for _ in range(200):
+            a = np.array( [ rng.random() < 0.3 for _ in range(60) ] )
+            b = np.array( [ rng.random() < 0.3 for _ in range(60) ] )
+            for val in [None, 2.0, 10.0, 200.0]:
+                sub_a, sub_b = lp.subset_rows("Year", a, b, val=val)
+                if val is None and ( not a.any() or not b.any() ):
+                    # Nothing left for one side, so nothing is left for the other
+                    assert( b.any() or not sub_a.any() )
+                    assert( a.any() or not sub_b.any() )
+                    continue
+                set_a, set_b = lp.subset( set( values[a] ), set( values[b] ), val=val )
+                assert( set( values[sub_a] ) == set_a )
+                assert( set( values[sub_b] ) == set_b )
+
+        # Shift tables are built once per category and difference
+        assert( lp.store.shift("Year", 2.0) is lp.store.shift("Year", 2.0) )
+
     def test_is_complete(self):
         lp = LogicPuzzle()
 
@@ -165,8 +341,13 @@ class LogicPuzzleTest(unittest.TestCase):
         lp.read_categories( os.path.join("tests", "categories1.txt") )
         lp.create_sets()
         assert( not lp.is_complete() )
-        for key in lp.full_sets:
-            lp.full_sets[key] = set([ lp.full_sets[key].pop() ])
+        lp.a_is_b("A","a1","B","b1")
+        lp.a_is_b("A","a2","B","b2")
+        lp.a_is_b("A","a1","C",1.0)
+        lp.a_is_b("A","a2","C",2.0)
+        lp.a_is_b("B","b1","C",1.0)
+        assert( not lp.is_complete() )
+        lp.a_is_b("B","b2","C",2.0)
         assert( lp.is_complete() )
 
     def test_check_single_category_list(self):
@@ -186,6 +367,9 @@ class LogicPuzzleTest(unittest.TestCase):
         for cat_A, el_A, cat_B in lp.full_sets:
             if (cat_A, el_A, cat_B) == ("A", "a1", "B"):
                 assert( lp.full_sets[(cat_A, el_A, cat_B)] == set( [ "b1", "b2" ] ) )
+            elif (cat_A, el_A, cat_B) == ("B", "b3", "A"):
+                # Both directions are the same data in the store
+                assert( lp.full_sets[(cat_A, el_A, cat_B)] == set( [ "a2", "a3" ] ) )
             else:
                 # Other sets should still have the full set of possibilities
                 assert( lp.full_sets[(cat_A, el_A, cat_B)] == lp.category_values[cat_B] )
@@ -231,6 +415,9 @@ class LogicPuzzleTest(unittest.TestCase):
                 assert( lp.full_sets[(cat_A, el_A, cat_B)] == set(["a1"]) )
             elif cat_A == "C" and cat_B == "A":
                 assert( lp.full_sets[(cat_A, el_A, cat_B)] == set(["a2","a3"]) )
+            elif (cat_A, el_A, cat_B) == ("B","b1","A"):
+                # Removing b1 from ("A","a1","B") removes a1 from ("B","b1","A") too
+                assert( lp.full_sets[(cat_A, el_A, cat_B)] == set(["a2","a3"]) )
             else:
                 # Each set should still have the full set of possibilities
                 assert( lp.full_sets[(cat_A, el_A, cat_B)] == lp.category_values[cat_B] )
@@ -470,36 +657,6 @@ class LogicPuzzleTest(unittest.TestCase):
         assert( lp.full_sets[("C",2.0,"B")] == set(["b1", "b2", "b3"]) )
         assert( lp.full_sets[("C",3.0,"B")] == set(["b1", "b2", "b3"]) )
 
-    def test_reflexive_exclusion(self):
-        lp = LogicPuzzle()
-        lp.read_categories( os.path.join("tests", "categories1.txt") )
-        lp.create_sets()
-
-        lp.a_is_b("A","a1","B","b1")
-        lp.full_sets[("B","b1","C")] = set([1.0])
-
-        lp.reflexive_exclusion()
-
-        assert( lp.full_sets[("A","a1","B")] == set(["b1"]) )
-        assert( lp.full_sets[("A","a2","B")] == set(["b2", "b3"]) )
-        assert( lp.full_sets[("A","a3","B")] == set(["b2", "b3"]) )
-        assert( lp.full_sets[("A","a1","C")] == set([1.0, 2.0, 3.0]) )
-        assert( lp.full_sets[("A","a2","C")] == set([1.0, 2.0, 3.0]) )
-        assert( lp.full_sets[("A","a3","C")] == set([1.0, 2.0, 3.0]) )
-        assert( lp.full_sets[("B","b1","C")] == set([1.0]) )
-        assert( lp.full_sets[("B","b2","C")] == set([1.0, 2.0, 3.0]) )
-        assert( lp.full_sets[("B","b3","C")] == set([1.0, 2.0, 3.0]) )
-
-        assert( lp.full_sets[("B","b1","A")] == set(["a1"]) )
-        assert( lp.full_sets[("B","b2","A")] == set(["a2", "a3"]) )
-        assert( lp.full_sets[("B","b3","A")] == set(["a2", "a3"]) )
-        assert( lp.full_sets[("C",1.0,"A")] == set(["a1", "a2", "a3"]) )
-        assert( lp.full_sets[("C",2.0,"A")] == set(["a1", "a2", "a3"]) )
-        assert( lp.full_sets[("C",3.0,"A")] == set(["a1", "a2", "a3"]) )
-        assert( lp.full_sets[("C",1.0,"B")] == set(["b1", "b2", "b3"]) )
-        assert( lp.full_sets[("C",2.0,"B")] == set(["b2", "b3"]) )
-        assert( lp.full_sets[("C",3.0,"B")] == set(["b2", "b3"]) )
-
     def test_link_inclusion(self):
         lp = LogicPuzzle()
         lp.read_categories( os.path.join("tests", "categories1.txt") )
@@ -523,15 +680,16 @@ class LogicPuzzleTest(unittest.TestCase):
         assert( lp.full_sets[("B","b2","C")] == set([3.0]) )
         assert( lp.full_sets[("B","b3","C")] == set([2.0]) )
 
-        assert( lp.full_sets[("B","b1","A")] == set(["a1", "a2", "a3"]) )
+        # The reverse sets are the same data as the sets above
+        assert( lp.full_sets[("B","b1","A")] == set(["a2", "a3"]) )
         assert( lp.full_sets[("B","b2","A")] == set(["a1", "a2", "a3"]) )
         assert( lp.full_sets[("B","b3","A")] == set(["a1", "a2", "a3"]) )
-        assert( lp.full_sets[("C",1.0,"A")] == set(["a1", "a2", "a3"]) )
+        assert( lp.full_sets[("C",1.0,"A")] == set(["a2", "a3"]) )
         assert( lp.full_sets[("C",2.0,"A")] == set(["a1", "a2", "a3"]) )
         assert( lp.full_sets[("C",3.0,"A")] == set(["a1", "a2", "a3"]) )
-        assert( lp.full_sets[("C",1.0,"B")] == set(["b1", "b2", "b3"]) )
-        assert( lp.full_sets[("C",2.0,"B")] == set(["b1", "b2", "b3"]) )
-        assert( lp.full_sets[("C",3.0,"B")] == set(["b1", "b2", "b3"]) )
+        assert( lp.full_sets[("C",1.0,"B")] == set(["b1"]) )
+        assert( lp.full_sets[("C",2.0,"B")] == set(["b1", "b3"]) )
+        assert( lp.full_sets[("C",3.0,"B")] == set(["b1", "b2"]) )
 
     def test_link_exclusion(self):
         lp = LogicPuzzle()
@@ -553,16 +711,33 @@ class LogicPuzzleTest(unittest.TestCase):
         assert( lp.full_sets[("B","b2","C")] == set([2.0, 3.0]) )
         assert( lp.full_sets[("B","b3","C")] == set([2.0, 3.0]) )
 
-        assert( lp.full_sets[("B","b1","A")] == set(["a1", "a2", "a3"]) )
+        # The reverse sets are the same data as the sets above
+        assert( lp.full_sets[("B","b1","A")] == set(["a2", "a3"]) )
         assert( lp.full_sets[("B","b2","A")] == set(["a1", "a2", "a3"]) )
         assert( lp.full_sets[("B","b3","A")] == set(["a1", "a2", "a3"]) )
-        assert( lp.full_sets[("C",1.0,"A")] == set(["a1", "a2", "a3"]) )
+        assert( lp.full_sets[("C",1.0,"A")] == set(["a2", "a3"]) )
         assert( lp.full_sets[("C",2.0,"A")] == set(["a1", "a2", "a3"]) )
         assert( lp.full_sets[("C",3.0,"A")] == set(["a1", "a2", "a3"]) )
         assert( lp.full_sets[("C",1.0,"B")] == set(["b1"]) )
         assert( lp.full_sets[("C",2.0,"B")] == set(["b2", "b3"]) )
         assert( lp.full_sets[("C",3.0,"B")] == set(["b2", "b3"]) )
 
+    def test_link_inclusion_matches_reference(self):
+        for seed in range(20):
+            lp = random_puzzle(seed)
+            expected = lp.clone_sets()
+            reference_link_inclusion(lp, expected)
+            lp.link_inclusion()
+            assert( lp.clone_sets() == expected )
+
+    def test_link_exclusion_matches_reference(self):
+        for seed in range(20):
+            lp = random_puzzle(seed)
+            expected = lp.clone_sets()
+            reference_link_exclusion(lp, expected)
+            lp.link_exclusion()
+            assert( lp.clone_sets() == expected )
+
     def test_n_of_n(self):
         lp = LogicPuzzle()
         lp.read_categories( os.path.join("tests", "categories1.txt") )
@@ -592,6 +767,863 @@ class LogicPuzzleTest(unittest.TestCase):
         assert( lp.full_sets[("C",2.0,"B")] == set(["b1", "b2", "b3"]) )
         assert( lp.full_sets[("C",3.0,"B")] == set(["b1", "b2", "b3"]) )
 
+    ##### Test Propagation #########################################################################################################
+
+    def test_propagate(self):
+        # The worklist should reach the same state as sweeping everything
+        for game in ["game1", "game2", "game4"]:
+            cat_f_name = os.path.join("Games", game, "categories.txt")
+            rule_f_name = os.path.join("Games", game, "rules.txt")
+
+            swept = LogicPuzzle(cat_f_name, rule_f_name)
+            swept.solve(show=False, worklist=False)
+            queued = LogicPuzzle(cat_f_name, rule_f_name)
+            queued.solve(show=False, worklist=True)
+
+            assert( queued.is_complete() )
+            assert( queued.clone_sets() == swept.clone_sets() )
+            assert( not queued.propagation.queue )
+
+    def test_search(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests", "search_rules.txt") )
+        lp.propagate()
+        assert( not lp.is_complete() )
+        propagated = lp.clone_sets()
+
+        # Out of guesses straight away, the puzzle should be left as it was
+        assert( not lp.search(node_limit=0) )
+        assert( lp.limit_reached )
+        assert( lp.clone_sets() == propagated )
+
+        assert( lp.search() )
+        assert( not lp.limit_reached )
+        assert( lp.nodes > 0 )
+        assert( lp.is_complete() )
+        assert( not lp.contains_empty_sets() )
+        assert( lp.full_sets[("A","a1","B")] == set(["b1"]) )
+        a2 = LogicPuzzle.peek( lp.full_sets[("A","a2","C")] )
+        a3 = LogicPuzzle.peek( lp.full_sets[("A","a3","C")] )
+        assert( a2 > a3 )
+
+    def test_search_contradiction(self):
+        categories = "C0 : c0v0, c0v1\nC1 : c1v0, c1v1"
+        for worklist in [True, False]:
+            lp = LogicPuzzle.from_text( categories, "c0v0 = c1v0\nc0v0 != c1v0" )
+            solved = lp.solve( show=False, return_results=True, worklist=worklist, search=True )[0]
+            assert( not solved )
+            assert( lp.contains_empty_sets() )
+
+    def test_count_solutions(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests", "search_rules.txt") )
+        lp.create_sets()
+        before = lp.clone_sets()
+
+        # a2 and a3 can be b2 and b3 either way round, and (a2, a3) can be (2, 1), (3, 1) or (3, 2) in C
+        assert( lp.count_solutions(limit=None) == 6 )
+        assert( lp.count_solutions() == 2 )
+        assert( not lp.is_unique() )
+        assert( lp.clone_sets() == before )
+
+        # Out of guesses before the count could be decided
+        assert( lp.count_solutions(limit=None, node_limit=1) < 6 )
+        assert( lp.limit_reached )
+        assert( lp.is_unique(node_limit=0) is None )
+
+        # Solved by deduction alone
+        lp = LogicPuzzle( os.path.join("Games", "game1", "categories.txt"), os.path.join("Games", "game1", "rules.txt") )
+        assert( lp.is_unique() )
+        assert( lp.nodes == 0 )
+
+        # Contradicting rules have no solution
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests", "search_rules.txt") )
+        lp.set_rule_lines( ["a1 != b1"] )
+        assert( lp.count_solutions() == 0 )
+
+        # Also when a sweep solve already found the contradiction
+        lp = LogicPuzzle.from_text( "C0 : c0v0, c0v1\nC1 : c1v0, c1v1", "c0v0 = c1v0\nc0v0 != c1v0" )
+        lp.solve( show=False, worklist=False )
+        assert( lp.contains_empty_sets() )
+        assert( lp.count_solutions() == 0 )
+        assert( not lp.is_unique() )
+
+    def test_progress_and_cancel(self):
+        cat_f_name = os.path.join("Games", "game4", "categories.txt")
+        rule_f_name = os.path.join("Games", "game4", "rules.txt")
+        for worklist in [True, False]:
+            lp = LogicPuzzle(cat_f_name, rule_f_name)
+            progress = []
+            solved, loops, _ = lp.solve( show=False, return_results=True, worklist=worklist, progress=lambda rounds, remaining: progress.append( (rounds, remaining) ) )
+            assert( solved )
+            assert( [ rounds for rounds, remaining in progress ] == list( range(1, loops + 1) ) )
+            assert( all( [ a[1] >= b[1] for a, b in zip(progress, progress[1:]) ] ) )
+            assert( progress[-1][1] == lp.store.remaining() )
+            assert( lp.progress is None )
+
+            # Cancelled from the first progress report, so the solve stops before the next rule or pass
+            lp = LogicPuzzle(cat_f_name, rule_f_name)
+            cancel = threading.Event()
+            with self.assertRaises(SolveCancelled):
+                lp.solve( show=False, worklist=worklist, progress=lambda rounds, remaining: cancel.set(), cancel=cancel )
+            assert( not lp.is_complete() )
+            assert( lp.cancel_event is None )
+
+        # Cancelled from another thread before anything ran
+        lp = LogicPuzzle(cat_f_name, rule_f_name)
+        cancel = threading.Event()
+        thread = threading.Thread( target=cancel.set )
+        thread.start()
+        thread.join()
+        with self.assertRaises(SolveCancelled):
+            lp.solve( show=False, search=True, cancel=cancel )
+        assert( lp.store.remaining() == sum( [ m.size for m in lp.store.matrices.values() ] ) )
+
+    def test_n_of_n_hall_set(self):
+        lp = random_puzzle(0)
+        lp.create_sets()
+
+        # w1, w2 and w3 share x1, x2 and x3 between them without having identical sets
+        lp.full_sets[("W","w1","X")] = set(["x1", "x2"])
+        lp.full_sets[("W","w2","X")] = set(["x2", "x3"])
+        lp.full_sets[("W","w3","X")] = set(["x1", "x3"])
+        lp.n_of_n()
+
+        assert( lp.full_sets[("W","w4","X")] == set(["x4", "x5"]) )
+        assert( lp.full_sets[("W","w5","X")] == set(["x4", "x5"]) )
+        assert( lp.full_sets[("X","x1","W")] == set(["w1", "w3"]) )
+        assert( lp.full_sets[("X","x4","W")] == set(["w4", "w5"]) )
+
+# Test methods in Propagator
+class PropagatorTest(unittest.TestCase):
+
+    def test_compiled_rules(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests","rules1.txt") )
+
+        assert( [ type(rule) for rule in lp.rules ] == [AIsB, AIsNotB, OneToMany, ManyToMany, AGreaterThanB, AGreaterThanB] )
+        func, params = lp.rules[0]
+        assert( func == lp.a_is_b and params == ["A","a1","B","b1"] )
+
+        assert( lp.rules[0].reads() == [] )
+        assert( lp.rules[0].writes() == [("A","a1","B"), ("B","b1","A")] )
+        assert( lp.rules[2].reads() == [("A","a2","B"), ("A","a2","C")] )
+        # ("B","b2") and ("B","b1") share a category, so they don't read each other
+        assert( len( lp.rules[3].reads() ) == 6 )
+        assert( lp.rules[4].reads() == [("A","a1","C"), ("B","b2","C")] )
+        assert( ("B","b2","C") in lp.rules[2].writes() )
+        assert( lp.rules[4].writes() == [("A","a1","B"), ("B","b2","A"), ("A","a1","C"), ("B","b2","C")] )
+
+    def test_entailed(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests","rules1.txt") )
+        assert( not any( [ rule.entailed() for rule in lp.rules ] ) )
+
+        # Entailed once propagating can't change anything
+        for rule in lp.rules[:2]:
+            rule.propagate()
+            assert( rule.entailed() )
+        mark = lp.checkpoint()
+        for rule in lp.rules[:2]:
+            rule.propagate()
+        assert( not lp.store.changed_since(mark) )
+
+        lp.rollback(0)
+        assert( not lp.rules[0].entailed() )
+
+        # a1,C > b2,C only holds once every value left for a1 is larger
+        rule = lp.rules[4]
+        lp.full_sets[("A","a1","C")] = set([3.0])
+        lp.full_sets[("B","b2","C")] = set([1.0, 2.0])
+        lp.a_is_not_b("A","a1","B","b2")
+        assert( not rule.entailed() )
+        lp.a_is_b("A","a1","C",3.0)
+        assert( rule.entailed() )
+
+    def test_register_rule(self):
+        # A new rule type that isn't a LogicPuzzle method, it only has to override propagate
+        class OnlyOne(Propagator):
+            def propagate(self):
+                self.puzzle.a_is_b(*self.params)
+
+        class CustomPuzzle(LogicPuzzle):
+            pass
+
+        CustomPuzzle.register_rule(7, OnlyOne)
+        assert( CustomPuzzle.rule_types[7] == OnlyOne )
+        assert( not 7 in LogicPuzzle.rule_types )
+
+        lp = CustomPuzzle( os.path.join("tests", "categories1.txt") )
+        lp.set_rules( [ (7, [ Token("a1", lp), Token("=", lp), Token("b1", lp) ]) ] )
+        assert( lp.rules[0][0] == lp.rules[0].propagate )
+        lp.propagate()
+        assert( lp.full_sets[("A","a1","B")] == set(["b1"]) )
+
+    def test_watch_rule(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt") )
+        lp.propagate()
+        queue = lp.propagation
+
+        lp.rules.append( OneToMany(lp, ["A","a1",[("B","b1"),("B","b2")]]) )
+        queue.watch_rule(0)
+        assert( queue.watchers[("A","B")][0] == [0] )
+        queue.run()
+        assert( lp.full_sets[("A","a1","B")] == set(["b1","b2"]) )
+
+        queue.unwatch_rule(0)
+        assert( queue.watchers[("A","B")][0] == [] )
+        lp.a_is_not_b("A","a1","B","b1")
+        queue.assume( lp.a_is_not_b, "A","a2","B","b2" )
+        assert( not ("rule", 0) in queue.queued )
+
+    def test_retire_entailed(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests", "search_rules.txt") )
+        lp.propagate()
+        assert( 0 in lp.propagation.retired )
+        assert( lp.search() )
+
+        # Rules entailed by the guesses are brought back when the guesses are undone
+        lp.rollback(0)
+        assert( lp.propagation.retired == {} )
+
+# Test methods in BatchSolver
+class BatchSolverTest(unittest.TestCase):
+
+    def test_solve_many(self):
+        games = [ ( os.path.join("Games", game, "categories.txt"), os.path.join("Games", game, "rules.txt") ) for game in ["game1", "game2", "game4"] ]
+        invalid = ( ["A : a1, a2", "B : b1, b2"], ["a1 = b1", "a2 = b3"] )
+        puzzles = [ games[0], invalid, games[1], games[2] ]
+
+        results = list( solve_many( puzzles, workers=2, chunk_size=1 ) )
+        assert( [ r["index"] for r in results ] == [0, 1, 2, 3] )
+        assert( [ r["solved"] for r in results ] == [True, False, True, True] )
+
+        # A puzzle that can't be read doesn't stop the others
+        assert( results[1]["error"].startswith("InvalidTokenException") )
+        assert( all( [ r["error"] is None for r in results if r["index"] != 1 ] ) )
+
+        lp = LogicPuzzle( *games[0] )
+        lp.solve(show=False)
+        assert( results[0]["grid"] == lp.get_grid().tolist() )
+
+        # Completion order still gives every puzzle once, and in process gives the same results
+        unordered = list( solve_many( iter(puzzles * 3), workers=2, chunk_size=2, ordered=False ) )
+        assert( sorted( [ r["index"] for r in unordered ] ) == list(range(12)) )
+        in_process = list( solve_many( puzzles, workers=0 ) )
+        assert( [ r["grid"] for r in in_process ] == [ r["grid"] for r in results ] )
+
+        # Profiling adds the report to each result instead of making every solve an error
+        profiled = list( solve_many( puzzles, workers=0, profile=True ) )
+        assert( [ r["solved"] for r in profiled ] == [True, False, True, True] )
+        assert( all( [ r["error"] is None and len( r["profile"]["passes"] ) > 0 for r in profiled if r["index"] != 1 ] ) )
+        assert( not "profile" in results[0] )
+
+# Send one HTTP request to a SolveServer, returns the status code and the JSON answer
+async def http_request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = b"" if body is None else ( body if isinstance(body, bytes) else json.dumps(body).encode("utf-8") )
+    writer.write( "{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n".format(method, path, len(data)).encode("latin-1") + data )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int( head.split()[1] ), json.loads(body)
+
+# Test methods in SolveServer
+class SolveServerTest(unittest.TestCase):
+
+    def test_solve_server(self):
+        games = []
+        for game in ["game1", "game2", "game4"]:
+            f = open( os.path.join("Games", game, "categories.txt") )
+            categories = f.read()
+            f.close()
+            f = open( os.path.join("Games", game, "rules.txt") )
+            rules = f.read().splitlines()
+            f.close()
+            games.append( { "categories" : categories, "rules" : rules } )
+
+        async def requests():
+            async with SolveServer(port=0, workers=2) as server:
+                # Many requests at once, answered in any order
+                answers = await asyncio.gather( *[ http_request(server.port, "POST", "/solve", game) for game in games * 3 ] )
+                assert( all( [ code == 200 and answer["status"] == "solved" for code, answer in answers ] ) )
+                lp = LogicPuzzle( os.path.join("Games", "game1", "categories.txt"), os.path.join("Games", "game1", "rules.txt") )
+                lp.solve(show=False)
+                assert( answers[0][1]["grid"] == lp.get_grid().tolist() )
+
+                # Unsolved, with search, and rules that can't be read
+                code, answer = await http_request( server.port, "POST", "/solve", { "categories" : ["A : a1, a2", "B : b1, b2"], "rules" : [] } )
+                assert( code == 200 and answer["status"] == "unsolved" )
+                code, answer = await http_request( server.port, "POST", "/solve", { "categories" : ["A : a1, a2", "B : b1, b2"], "rules" : [],
+                                                                                     "options" : { "search" : True } } )
+                assert( code == 200 and answer["status"] == "solved" and answer["nodes"] > 0 )
+                code, answer = await http_request( server.port, "POST", "/solve", { "categories" : ["A : a1, a2", "B : b1, b2"], "rules" : ["a1 = b3"] } )
+                assert( code == 422 and answer["error"].startswith("InvalidTokenException") )
+
+                # Puzzles seen before are answered from the cache, whatever the order of the requests
+                code, answer = await http_request( server.port, "POST", "/solve", games[0] )
+                assert( answer["cached"] and answer["grid"] == answers[0][1]["grid"] )
+
+                # No answer in time, and a timeout isn't cached
+                late = { "categories" : [ "C{} : ".format(c) + ", ".join( [ "c{}v{}".format(c, i) for i in range(10) ] ) for c in range(6) ],
+                         "rules" : [], "options" : { "search" : True }, "timeout" : 1e-6 }
+                code, answer = await http_request( server.port, "POST", "/solve", late )
+                assert( code == 504 and answer["status"] == "timeout" )
+                code, answer = await http_request( server.port, "POST", "/solve", dict( late, timeout=5 ) )
+                assert( code == 200 and not answer["cached"] )
+
+                # Requests that aren't understood
+                assert( ( await http_request( server.port, "POST", "/solve", b"{not json" ) )[0] == 400 )
+                assert( ( await http_request( server.port, "POST", "/solve", { "rules" : [] } ) )[0] == 400 )
+                assert( ( await http_request( server.port, "POST", "/solve", { "categories" : "categories.txt", "rules" : "rules.txt",
+                                                                              "options" : { "show" : True } } ) )[0] == 400 )
+                assert( ( await http_request( server.port, "GET", "/solve" ) )[0] == 405 )
+                assert( ( await http_request( server.port, "GET", "/nothing" ) )[0] == 404 )
+
+                code, answer = await http_request( server.port, "GET", "/health" )
+                assert( code == 200 and answer["requests"] == 15 )
+
+        asyncio.run( requests() )
+
+    def test_dead_worker(self):
+        slow = { "categories" : [ "C{} : ".format(c) + ", ".join( [ "c{}v{}".format(c, i) for i in range(10) ] ) for c in range(6) ],
+                 "rules" : [], "options" : { "search" : True, "node_limit" : 10 ** 9 }, "timeout" : 30 }
+
+        async def requests():
+            async with SolveServer(port=0, workers=1, timeout=30) as server:
+                # Kill the worker while it solves, the client still gets an answer
+                answer = asyncio.ensure_future( http_request(server.port, "POST", "/solve", slow) )
+                broken = server.executor
+                while not broken._processes:
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.5)
+                for process in list( broken._processes.values() ):
+                    process.kill()
+                code, answer = await answer
+                assert( code == 503 and answer["status"] == "error" and answer["error"].startswith("BrokenProcessPool") )
+                assert( server.executor is not broken )
+
+                # The pool is started again for the next requests, and the failure wasn't cached
+                code, answer = await http_request( server.port, "POST", "/solve", { "categories" : ["A : a1, a2", "B : b1, b2"], "rules" : ["a1 = b1"] } )
+                assert( code == 200 and answer["status"] == "solved" )
+                code, answer = await http_request( server.port, "POST", "/solve", dict( slow, timeout=1e-6 ) )
+                assert( code == 504 and not answer["cached"] )
+
+        asyncio.run( requests() )
+
+# Test methods in ResultCache
+class ResultCacheTest(unittest.TestCase):
+
+    def test_puzzle_key(self):
+        categories = ["A : a1, a2", "B : b1, b2"]
+        rules = ["a1 = b1\t# Rule 1"]
+        key = puzzle_key(categories, rules)
+        assert( puzzle_key( "A:a1,a2\n\nB :  b1 , b2\n", ["", "a1  =  b1"] ) == key )
+        assert( puzzle_key( categories, ["a1 = b2"] ) != key )
+        assert( puzzle_key( categories, rules, { "search" : True } ) != key )
+
+    def test_cache(self):
+        cat_f_name = os.path.join("Games", "game1", "categories.txt")
+        rule_f_name = os.path.join("Games", "game1", "rules.txt")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        directory = directory.name
+        cache = ResultCache( capacity=2, directory=directory )
+
+        result = cache.solve(cat_f_name, rule_f_name)
+        assert( result["solved"] and not result["cached"] )
+        again = cache.solve(cat_f_name, rule_f_name)
+        assert( again["cached"] and again["grid"] == result["grid"] and again["iterations"] == result["iterations"] )
+        assert( cache.hits == 1 and cache.misses == 1 )
+
+        # Answers can be changed without changing what's kept
+        again["grid"][1][0] = "changed"
+        assert( cache.solve(cat_f_name, rule_f_name)["grid"] == result["grid"] )
+
+        # Least recently used out of memory, but still on disk, and found again by a new cache on the same directory
+        for i in range(3):
+            cache.solve( ["A : a1, a2", "B : b1, b2"], ["a1 = b{}".format(i % 2 + 1)], worklist=bool(i // 2) )
+        assert( len(cache.memory) == 2 )
+        assert( len(cache) == 4 )
+        reopened = ResultCache( capacity=2, directory=directory )
+        assert( reopened.solve(cat_f_name, rule_f_name)["cached"] )
+
+        # Only max_bytes of results are kept on disk
+        small_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(small_directory.cleanup)
+        small = ResultCache( capacity=2, directory=small_directory.name, max_bytes=400 )
+        for i in range(5):
+            small.solve( ["A : a1, a2", "B : b1, b2"], ["a1 = b1"], node_limit=i )
+        assert( 0 < len(small.disk) < 5 )
+        assert( small.disk_bytes <= 400 )
+        assert( sorted( os.listdir(small.directory) ) == sorted( [ key + ".json" for key in small.disk ] ) )
+
+        # Unfinished searches aren't kept
+        assert( not cache.solve( ["A : a1, a2", "B : b1, b2"], [], search=True, node_limit=0 )["solved"] )
+        assert( not cache.solve( ["A : a1, a2", "B : b1, b2"], [], search=True, node_limit=0 )["cached"] )
+
+    def test_untranslatable_lookup(self):
+        cache = ResultCache()
+        unsolved = cache.solve( ["A : a1, a2, a3", "B : b1, b2, b3"], ["a1 = b1"] )
+        assert( not unsolved["solved"] and len(cache) == 1 )
+        assert( cache.hits == 0 and cache.misses == 1 )
+
+        # Same puzzle keyed on B, an unsolved grid can't be sorted on it, so it's a miss and not a hit
+        canonical = CanonicalPuzzle( ["B : b1, b2, b3", "A : a1, a2, a3"], ["a1 = b1"] )
+        assert( cache.lookup(canonical) is None )
+        assert( cache.hits == 0 and cache.misses == 2 )
+        assert( not cache.lookup( CanonicalPuzzle( ["A : a1, a2, a3", "B : b1, b2, b3"], ["a1 = b1"] ) ) is None )
+        assert( cache.hits == 1 and cache.misses == 2 )
+
+# Test methods in Canonical
+class CanonicalTest(unittest.TestCase):
+
+    # The lines of a game with the category lines, the values in each category and the rule lines shuffled
+    def shuffled_game(self, game, seed):
+        record = record_from_files( os.path.join("Games", game, "categories.txt"), os.path.join("Games", game, "rules.txt") )
+        rng = random.Random(seed)
+        categories = []
+        for line in record["categories"]:
+            title, values = line.split(":")
+            values = values.split(",")
+            rng.shuffle(values)
+            categories.append( "{} : {}".format( title, " , ".join(values) ) )
+        rng.shuffle(categories)
+        rules = list( record["rules"] )
+        rng.shuffle(rules)
+        return record, categories, rules
+
+    def test_canonical_form(self):
+        for game in ["game1", "game3", "game5"]:
+            record, categories, rules = self.shuffled_game(game, 0)
+            original = CanonicalPuzzle( record["categories"], record["rules"] )
+            shuffled = CanonicalPuzzle(categories, rules)
+            assert( original.key() == shuffled.key() )
+            assert( original.category_lines == shuffled.category_lines )
+            assert( original.key() != original.key( { "search" : True } ) )
+
+            # Solutions translate between the layouts
+            grid = load_puzzle( record["categories"], record["rules"] )
+            grid.solve(show=False)
+            grid = grid.get_grid().tolist()
+            other = load_puzzle(categories, rules)
+            other.solve(show=False)
+            other = other.get_grid().tolist()
+            assert( not original.to_canonical(grid) is None )
+            assert( original.to_canonical(grid) == shuffled.to_canonical(other) )
+            assert( shuffled.to_caller( original.to_canonical(grid) ) == other )
+            assert( original.to_caller( shuffled.to_canonical(other) ) == grid )
+
+        # A different puzzle gets a different key
+        assert( CanonicalPuzzle( ["A : a1, a2", "B : b1, b2"], ["a1 = b1"] ).key() != CanonicalPuzzle( ["A : a1, a2", "B : b1, b2"], ["a1 = b2"] ).key() )
+        assert( CanonicalPuzzle( ["A : 1, 2", "B : b1, b2"], [] ).key() == CanonicalPuzzle( ["B : b2, b1", "A : 2.0, 1.0"], [] ).key() )
+
+        # Rows of an unfinished grid can't be matched up under another key category
+        puzzle = CanonicalPuzzle( ["B : b1, b2", "A : a1, a2"], [] )
+        unsolved = [ ["A", "B"], ["a1", ""], ["a2", ""] ]
+        assert( puzzle.to_caller(unsolved) is None )
+        assert( CanonicalPuzzle( ["A : a1, a2", "B : b1, b2"], [] ).to_caller(unsolved) == unsolved )
+
+    def test_first_duplicates(self):
+        record, categories, rules = self.shuffled_game("game2", 1)
+        puzzles = [ ( record["categories"], record["rules"] ), ( ["A : a1, a2", "B : b1, b2"], [] ), (categories, rules), ( ["A : a2, a1", "B : b1, b2"], [] ) ]
+        assert( first_duplicates(puzzles) == [0, 1, 0, 1] )
+
+        # The cache answers the shuffled puzzle from the original one, in its own layout
+        cache = ResultCache()
+        first = cache.solve( record["categories"], record["rules"] )
+        result = cache.solve(categories, rules)
+        assert( result["cached"] and not first["cached"] )
+        lp = load_puzzle(categories, rules)
+        lp.solve(show=False)
+        assert( result["grid"] == lp.get_grid().tolist() )
+
+# Test methods in Corpus
+class CorpusTest(unittest.TestCase):
+
+    def test_read_write_corpus(self):
+        records = list( records_from_games("Games") )
+        assert( [ r["id"] for r in records ] == ["game1", "game2", "game3", "game4", "game5"] )
+        assert( records[0]["categories"][0] == "Attendees:Jack,Kit,Mitch,Ned,Pam" )
+
+        results = solve_many( corpus_puzzles(records), workers=0 )
+        for record, result in zip(records, results):
+            record["solution"] = result["grid"]
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for suffix in [".jsonl", ".jsonl.gz"]:
+            f_name = os.path.join( directory.name, "corpus" + suffix )
+            assert( write_corpus( f_name, iter(records[:3]) ) == 3 )
+            assert( write_corpus( f_name, iter(records[3:]), append=True ) == 2 )
+            assert( list( read_corpus(f_name) ) == records )
+
+        # Records feed LogicPuzzle directly
+        lp = puzzle_from_record( records[1] )
+        lp.solve(show=False)
+        assert( matches_solution( records[1], lp.get_grid().tolist() ) )
+        assert( matches_solution( { "categories" : [], "rules" : [] }, [] ) is None )
+
+    def test_read_corpus_errors(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        f_name = os.path.join( directory.name, "corpus.jsonl" )
+        f = open(f_name, "w")
+        f.write('{"categories": ["A : a1"], "rules": []}\n\n{"categories": \n')
+        f.close()
+
+        records = read_corpus(f_name)
+        assert( next(records)["categories"] == ["A : a1"] )
+        with self.assertRaises(ValueError) as e:
+            next(records)
+        assert( "line 3" in str(e.exception) )
+
+# Test methods in Generator
+class GeneratorTest(unittest.TestCase):
+
+    def test_generate(self):
+        for options in [ {}, { "n_categories" : 2, "n_values" : 2, "numeric" : 0 }, { "n_categories" : 4, "n_values" : 5, "numeric" : 2 } ]:
+            records = list( generate_puzzles(3, seed=7, **options) )
+            assert( records == list( generate_puzzles(3, seed=7, **options) ) )
+
+            # Every puzzle is solvable, and solves to the hidden solution
+            for record in records:
+                lp = puzzle_from_record(record)
+                lp.solve(show=False)
+                assert( lp.is_complete() )
+                assert( matches_solution( record, lp.get_grid().tolist() ) )
+
+    def test_rule_mix(self):
+        record = PuzzleGenerator( seed=1, n_values=5, rule_mix={ 2 : 1 }, max_clues=4 ).generate()
+        # Only != clues until max_clues, then = clues settle the rest
+        assert( all( [ "!=" in rule for rule in record["rules"][:4] ] ) )
+        assert( all( [ not "!=" in rule for rule in record["rules"][4:] ] ) )
+        assert( record["solution"] is not None )
+
+        with self.assertRaises(ValueError):
+            PuzzleGenerator( n_categories=2, numeric=3 )
+
+    def test_clue_params(self):
+        # Clues compile to the same rules the parser gives for their text
+        generator = PuzzleGenerator( seed=2, n_categories=4, n_values=4, numeric=2 )
+        lp = LogicPuzzle()
+        lp.set_categories( generator.category_lines() )
+        for rule_type in range(1, 7):
+            for _ in range(20):
+                number, params, text = generator.clue(rule_type)
+                lp.rules = []
+                lp.set_rule_lines( [text] )
+                assert( type( lp.rules[0] ) == LogicPuzzle.rule_types[number] )
+                assert( lp.rules[0][1] == params )
+
+    def test_generate_unique(self):
+        generator = UniquePuzzleGenerator( seed=5, n_categories=3, n_values=4 )
+        records = [ generator.generate() for _ in range(5) ]
+        assert( generator.puzzle.store.checkpoint() > 0 )
+
+        for record in records:
+            lp = puzzle_from_record(record)
+            lp.solve(show=False)
+            assert( lp.is_complete() )
+            assert( matches_solution( record, lp.get_grid().tolist() ) )
+
+            # Every clue is needed
+            for i in range(len( record["rules"] )):
+                lp = load_puzzle( record["categories"], record["rules"][:i] + record["rules"][i+1:] )
+                lp.solve(show=False)
+                assert( not lp.is_complete() )
+
+        # Minimizing only ever drops clues
+        generator = UniquePuzzleGenerator( seed=5, n_categories=3, n_values=4, minimize=False )
+        assert( all( [ len( generator.generate()["rules"] ) >= len( record["rules"] ) for record in records[:1] ] ) )
+        assert( [ r["rules"] for r in generate_unique_puzzles(3, seed=5) ] == [ r["rules"] for r in generate_unique_puzzles(3, seed=5) ] )
+
+        # Many puzzles on one solver, each starting from nothing the last one worked out
+        assert( len( list( generate_unique_puzzles(40, seed=2) ) ) == 40 )
+
+    def test_contradicting_clues(self):
+        # A clue that is false for the hidden solution is an error, not a puzzle that gets clues forever
+        for generator in [ PuzzleGenerator( seed=3, max_clues=1 ), UniquePuzzleGenerator( seed=3, max_clues=1 ) ]:
+            false_clue = ( 1, list( generator.unit("C0", 0) + generator.unit("C1", 1) ),
+                           "{} = {}".format( generator.element("C0", 0), generator.element("C1", 1) ) )
+            generator.random_clue = lambda: false_clue
+            with self.assertRaises(RuntimeError):
+                generator.generate()
+
+    def test_benchmark(self):
+        results = list( run_benchmark( [ (3,4) ], seeds=2, worklist=[True, False] ) )
+        assert( len(results) == 4 )
+        assert( all( [ r["solved"] and r["peak_memory"] > 0 and r["solve_time"] > 0 for r in results ] ) )
+        assert( [ r["tasks"] is None for r in results ] == [False, True, False, True] )
+        assert( parse_sizes("3x4,5X6") == [ (3,4), (5,6) ] )
+
+# Test methods in Profiler
+class ProfilerTest(unittest.TestCase):
+
+    def test_profile(self):
+        cat_f_name = os.path.join("Games", "game1", "categories.txt")
+        rule_f_name = os.path.join("Games", "game1", "rules.txt")
+        for worklist in [True, False]:
+            lp = LogicPuzzle(cat_f_name, rule_f_name)
+            report = lp.solve(show=False, worklist=worklist, profile=True)
+            assert( report is lp.profile_report )
+            assert( lp.profiler is None )
+            assert( set( report["passes"] ) == set(["link_inclusion", "link_exclusion", "n_of_n", "difference_bounds"]) )
+            assert( sorted( [ entry["index"] for entry in report["rules"] ] ) == list( range( len(lp.rules) ) ) )
+
+            # Every removed possibility is counted once, by the rule or pass that removed it
+            pruned = sum( [ entry["pruned"] for entry in report["rules"] ] ) + sum( [ entry["pruned"] for entry in report["passes"].values() ] )
+            assert( pruned == sum( [ len(flip_rows) for pair, flip_rows, flip_cols in lp.store.trail ] ) )
+            assert( report["total_time"] >= sum( [ entry["time"] for entry in report["rules"] ] ) )
+
+        lp = LogicPuzzle(cat_f_name, rule_f_name)
+        assert( lp.solve(show=False) is None )
+        assert( lp.profile_report is None )
+        solved, sweeps, grid, report = LogicPuzzle(cat_f_name, rule_f_name).solve(show=False, return_results=True, profile=True)
+        assert( solved and report["rules"][0]["calls"] > 0 )
+        assert( "n_of_n" in report_table(report).get_string() )
+
+# Test methods in TraceRecorder
+class TraceRecorderTest(unittest.TestCase):
+
+    def test_trace(self):
+        cat_f_name = os.path.join("Games", "game1", "categories.txt")
+        rule_f_name = os.path.join("Games", "game1", "rules.txt")
+        lp = LogicPuzzle(cat_f_name, rule_f_name)
+        recorder = lp.start_trace()
+        lp.solve(show=False)
+        assert( lp.stop_trace() is recorder )
+        assert( lp.store.recorder is None )
+
+        events = recorder.events()
+        assert( len(events) == sum( [ len(flip_rows) for pair, flip_rows, flip_cols in lp.store.trail ] ) )
+        # Pam = juicer is the first rule
+        assert( events[0][:4] == (1, "a_is_b", "rule", 0) )
+        assert( set( [ e[2] for e in events ] ) == set(["rule", "pass"]) )
+        assert( set( [ e[3] for e in events if e[2] == "pass" ] ) <= set(["link_inclusion", "link_exclusion", "n_of_n", "difference_bounds"]) )
+        assert( [ e[0] for e in events ] == sorted( [ e[0] for e in events ] ) )
+
+        # Replaying the trace reaches the same state, and the same solve gives the same trace
+        replayed = LogicPuzzle(cat_f_name)
+        recorder.replay(replayed.store)
+        assert( replayed.clone_sets() == lp.clone_sets() )
+
+        again = LogicPuzzle(cat_f_name, rule_f_name)
+        again.start_trace()
+        again.solve(show=False)
+        assert( diff_traces( recorder, again.stop_trace() ) is None )
+
+        swept = LogicPuzzle(cat_f_name, rule_f_name)
+        swept.start_trace()
+        swept.solve(show=False, worklist=False)
+        assert( not diff_traces( recorder, swept.stop_trace() ) is None )
+
+    def test_ring_buffer(self):
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests", "search_rules.txt") )
+        recorder = lp.start_trace(capacity=16)
+        assert( lp.search() )
+        lp.stop_trace()
+
+        # Only the last 16 events are kept
+        assert( recorder.count > 16 )
+        assert( recorder.dropped() == recorder.count - 16 )
+        assert( len( recorder.events() ) == 16 )
+        with self.assertRaises(ValueError):
+            recorder.replay( LogicPuzzle( os.path.join("tests", "categories1.txt") ).store )
+
+        # Search guesses and rollbacks are recorded too, and replayed
+        lp = LogicPuzzle( os.path.join("tests", "categories1.txt"), os.path.join("tests", "search_rules.txt") )
+        recorder = lp.start_trace()
+        lp.a_is_not_b("A","a3","C",1.0)
+        mark = lp.checkpoint()
+        lp.a_is_b("A","a1","C",1.0)
+        lp.rollback(mark)
+        assert( lp.search() )
+        events = recorder.events()
+        assert( events[0][1:3] == ("a_is_not_b", "other") )
+        assert( events[4] == ( 0, "rollback", "other", None, None, 3, None, None ) )
+        assert( "search" in [ e[2] for e in events ] )
+
+        replayed = LogicPuzzle( os.path.join("tests", "categories1.txt") )
+        recorder.replay(replayed.store)
+        assert( replayed.clone_sets() == lp.clone_sets() )
+
+# Test methods in DifferenceNetwork
+class DifferenceNetworkTest(unittest.TestCase):
+
+    def test_bounds(self):
+        values = np.arange(1.0, 11.0)
+        # a1 = a2 + 2, a2 = a3 + 3, a3 > a4
+        network = DifferenceNetwork( values, [ ("A","a1","A","a2",2.0), ("A","a2","A","a3",3.0), ("A","a3","A","a4",None) ] )
+        assert( network.feasible )
+        assert( len(network) == 4 )
+
+        # The whole chain is tightened in one step
+        lower, upper = network.bounds( np.full(4, 1.0), np.full(4, 10.0) )
+        ids = [ network.ids[ ("A", el) ] for el in ["a1", "a2", "a3", "a4"] ]
+        assert( list( lower[ids] ) == [7.0, 5.0, 2.0, 1.0] )
+        assert( list( upper[ids] ) == [10.0, 8.0, 5.0, 4.0] )
+        assert( list( values[ network.between(2.0, 5.0) ] ) == [2.0, 3.0, 4.0, 5.0] )
+
+    def test_negative_cycle(self):
+        values = np.arange(1.0, 11.0)
+        assert( not DifferenceNetwork( values, [ ("A","a1","A","a2",None), ("A","a2","A","a1",None) ] ).feasible )
+        assert( not DifferenceNetwork( values, [ ("A","a1","A","a2",2.0), ("A","a2","A","a3",3.0), ("A","a1","A","a3",4.0) ] ).feasible )
+        assert( DifferenceNetwork( values, [ ("A","a1","A","a2",2.0), ("A","a2","A","a3",3.0), ("A","a1","A","a3",5.0) ] ).feasible )
+
+    def test_difference_bounds(self):
+        lp = LogicPuzzle()
+        lp.set_categories( [ "A : a1, a2, a3, a4", "Year : 1, 2, 3, 4" ] )
+        lp.create_sets()
+        lp.set_rule_lines( [ "a1,Year > a2,Year", "a2,Year > a3,Year", "a3,Year > a4,Year" ] )
+
+        # A single pass settles the chain, without running the rules
+        lp.difference_bounds()
+        for el, year in [ ("a1", 4.0), ("a2", 3.0), ("a3", 2.0), ("a4", 1.0) ]:
+            assert( lp.full_sets[ ("A", el, "Year") ] == set([year]) )
+
+        # Rules that go round in a circle can't all hold
+        lp.set_rule_lines( [ "a4,Year > a1,Year" ] )
+        lp.difference_bounds()
+        assert( all( [ len( lp.full_sets[ ("A", el, "Year") ] ) == 0 for el in ["a1", "a2", "a3", "a4"] ] ) )
+
+    def test_replaced_rules(self):
+        # Two different puzzles on one instance, the second one's rules at the same indices as the first one's
+        lp = LogicPuzzle()
+        lp.set_categories( [ "A : a1, a2, a3", "Year : 1, 2, 3" ] )
+        lp.create_sets()
+        lp.set_rule_lines( [ "a1,Year > a2,Year", "a2,Year > a3,Year" ] )
+        lp.propagate()
+        assert( lp.full_sets[ ("A", "a1", "Year") ] == set([3.0]) )
+
+        lp.rollback(0)
+        lp.rules = []
+        lp.set_rule_lines( [ "a3,Year > a2,Year", "a2,Year > a1,Year" ] )
+        lp.propagate()
+        assert( not lp.contains_empty_sets() )
+        for el, year in [ ("a1", 1.0), ("a2", 2.0), ("a3", 3.0) ]:
+            assert( lp.full_sets[ ("A", el, "Year") ] == set([year]) )
+
+# Test methods in AllDifferent
+class AllDifferentTest(unittest.TestCase):
+
+    def test_max_matching(self):
+        m = np.array( [ [1,1,0], [1,0,0], [0,1,1] ], dtype=bool )
+        match, owner = max_matching(m)
+        assert( list(match) == [1,0,2] )
+        assert( list(owner) == [1,0,2] )
+
+        # Starting from an old matching drops the edges that are gone
+        m[2,2] = False
+        m[0,2] = True
+        match, owner = max_matching(m, match)
+        assert( list(match) == [2,0,1] )
+
+        m = np.array( [ [1,0], [1,0] ], dtype=bool )
+        match, owner = max_matching(m)
+        assert( sorted(match) == [-1,0] )
+
+    def test_all_different(self):
+        # Compare against every permutation on random 5x5 matrices
+        rng = np.random.default_rng(0)
+        perms = list( itertools.permutations(range(5)) )
+        for _ in range(50):
+            m = rng.random((5,5)) < 0.5
+            expected = np.zeros(m.shape, dtype=bool)
+            for perm in perms:
+                if all( [ m[i, perm[i]] for i in range(5) ] ):
+                    expected[ range(5), perm ] = True
+
+            supported, match = all_different(m)
+            assert( np.array_equal(supported, expected) )
+
+# Test methods in DomainStore
+class DomainStoreTest(unittest.TestCase):
+
+    def test_create(self):
+        lp = LogicPuzzle()
+        lp.read_categories( os.path.join("tests", "categories1.txt") )
+        store = DomainStore( lp.categories, lp.category_values )
+
+        # One matrix per pair of categories, with interned values
+        assert( len( store.matrices ) == 3 )
+        assert( store.matrix("A","C").shape == (3,3) )
+        assert( store.matrix("C","A").base is store.matrix("A","C") )
+        assert( store.values["C"] == [1.0, 2.0, 3.0] )
+        assert( store.ids["B"]["b2"] == 1 )
+        assert( len(store) == 18 )
+        assert( ("A","a1","B") in store and not ("A","a4","B") in store and not ("A","a1","A") in store )
+
+    def test_link(self):
+        lp = LogicPuzzle()
+        lp.read_categories( os.path.join("tests", "categories1.txt") )
+        store = DomainStore( lp.categories, lp.category_values )
+
+        assert( store.link("A","a1","B","b2") )
+        assert( store.get("A","a1","B") == set(["b2"]) )
+        assert( store.get("A","a2","B") == set(["b1","b3"]) )
+        assert( store.get("A","a3","B") == set(["b1","b3"]) )
+
+        # Linking again changes nothing
+        assert( not store.link("A","a1","B","b2") )
+        assert( store.unlink("A","a2","B","b1") )
+        assert( store.get("A","a2","B") == set(["b3"]) )
+        assert( not store.is_complete() )
+        assert( not store.contains_empty() )
+
+        store.unlink("A","a2","B","b3")
+        assert( store.contains_empty() )
+
+    def test_rollback(self):
+        lp = LogicPuzzle()
+        lp.read_categories( os.path.join("tests", "categories1.txt") )
+        store = DomainStore( lp.categories, lp.category_values )
+
+        mark = store.checkpoint()
+        assert( not store.changed_since(mark) )
+        store.link("A","a1","B","b2")
+        inner = store.checkpoint()
+        store.unlink("A","a2","C",1.0)
+        assert( store.changed_since(mark) and store.changed_since(inner) )
+
+        # Only the changes after the mark are undone
+        store.rollback(inner)
+        assert( store.get("A","a2","C") == set([1.0, 2.0, 3.0]) )
+        assert( store.get("A","a1","B") == set(["b2"]) )
+        assert( not store.changed_since(inner) )
+
+        store.rollback(mark)
+        assert( all( [ store.matrix(*pair).all() for pair in store.matrices ] ) )
+        assert( len(store.trail) == 0 )
+
+    def test_domain_set_map(self):
+        lp = LogicPuzzle()
+        lp.read_categories( os.path.join("tests", "categories1.txt") )
+        lp.create_sets()
+
+        # Writes through the facade land in the store
+        lp.full_sets[("A","a1","B")] = set(["b1","b2"])
+        assert( lp.store.get("A","a1","B") == set(["b1","b2"]) )
+        lp.full_sets[("A","a1","C")].remove(1.0)
+        lp.full_sets[("A","a1","C")] -= set([2.0])
+        assert( lp.store.get("A","a1","C") == set([3.0]) )
+        lp.full_sets[("A","a2","C")] &= set([1.0, 2.0])
+        assert( lp.full_sets[("A","a2","C")] == set([1.0, 2.0]) )
+        assert( set([1.0, 2.0]) == lp.full_sets[("A","a2","C")] )
+
+        # Set operations on a view give plain sets
+        assert( lp.category_values["C"] - lp.full_sets[("A","a2","C")] == set([3.0]) )
+        assert( lp.clone_sets()[("A","a1","B")] == set(["b1","b2"]) )
+
+    def test_get_grid(self):
+        lp = LogicPuzzle()
+        lp.read_categories( os.path.join("tests", "categories1.txt") )
+        lp.create_sets()
+        lp.a_is_b("A","a1","B","b2")
+        lp.a_is_b("A","a1","C",3.0)
+
+        titles, data = lp.get_grid(separate_title=True)
+        assert( titles == ["A","B","C"] )
+        assert( list(data[0]) == ["a1","b2","3.0"] )
+        assert( list(data[1]) == ["a2","",""] )
+
 # Test methods in Token
 class TokenTest(unittest.TestCase):
 
@@ -625,6 +1657,12 @@ class TokenTest(unittest.TestCase):
         result = tok.get_element(lp)
         assert( result is None )
 
+        assert( Token("C:2").get_element(lp) == ("C",2.0) )
+        assert( Token("C:2.0").get_element(lp) == ("C",2.0) )
+        assert( Token("A:a1").get_element(lp) == ("A","a1") )
+        assert( Token("C:4").get_element(lp) is None )
+        assert( Token("C:x").get_element(lp) is None )
+
     def test_validate_element_token(self):
         lp = LogicPuzzle()
         lp.read_categories( os.path.join("tests", "categories1.txt") )
@@ -847,6 +1885,30 @@ class RuleParserTest(unittest.TestCase):
         assert( node.next[TokenType.NUMBER].value == 5 )
         assert( len(node.next[TokenType.NUMBER].next) == 0 )
 
+    def test_load_grammar(self):
+        # The grammar is only built once, and doesn't depend on the working directory
+        cwd = os.getcwd()
+        try:
+            os.chdir( tempfile.gettempdir() )
+            rp = RuleParser()
+        finally:
+            os.chdir(cwd)
+        assert( rp.grammar is RuleParser().grammar )
+        assert( rp.grammar is load_grammar() )
+
+        # A custom grammar file gets its own trie
+        f = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False)
+        f.write("% Only equalities\n1:ELEMENT,=,ELEMENT\n")
+        f.close()
+        try:
+            rp = RuleParser( f.name )
+            assert( not rp.grammar is load_grammar() )
+            assert( list( rp.grammar.next ) == [TokenType.ELEMENT] )
+            assert( rp.grammar.next[TokenType.ELEMENT].next[TokenType.EQUAL].next[TokenType.ELEMENT].value == 1 )
+            assert( RuleParser( f.name ).grammar is rp.grammar )
+        finally:
+            os.remove(f.name)
+
     def test_tokenize(self):
         lp = LogicPuzzle()
         lp.read_categories( os.path.join("tests", "categories1.txt") )
@@ -865,6 +1927,19 @@ class RuleParserTest(unittest.TestCase):
 
         for row in tokenized:
             assert( all( [ t.valid for t in row ] ) )
+
+    def test_tokenize_ambiguous(self):
+        lp = LogicPuzzle()
+        lp.set_categories( [ "A : a1, a2, x", "B : b1, b2, x" ] )
+        rp = RuleParser()
+
+        tokenized = rp.tokenize( [ ["A:x", "=", "b1"] ], lp )
+        assert( [ t.value for t in tokenized[0] ] == [("A","x"), "=", ("B","b1")] )
+
+        with self.assertRaises(InvalidTokenException):
+            rp.tokenize( [ ["a1", "=", "b1"], ["x", "=", "b1"] ], lp )
+        with self.assertRaises(InvalidTokenException):
+            rp.tokenize( [ ["a1", "=", "[b1,x]"] ], lp )
     
     def test_validate(self):
         lp = LogicPuzzle()